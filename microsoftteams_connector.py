@@ -16,30 +16,35 @@
 #
 # Phantom App imports
 import asyncio
+import concurrent.futures
+import fcntl
 import grp
 import hashlib
 import json
 import os
 import pwd
+import random
 import re
+import select
+import stat
 import sys
+import tempfile
+import threading
 import time
+import uuid
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
 from typing import Any, Optional
 
 import encryption_helper
 import phantom.app as phantom
 import requests
-from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings, TurnContext
-from botbuilder.schema import Activity, ConversationParameters, ConversationReference
-from botbuilder.schema.teams import ChannelInfo, TeamInfo, TeamsChannelAccount, TeamsChannelData, TenantInfo
-from bs4 import BeautifulSoup
-from django.http import HttpResponse
 from phantom.action_result import ActionResult
 from phantom.base_connector import BaseConnector
 from phantom.utils import get_list_from_string
+from requests.adapters import HTTPAdapter
 
 from microsoftteams_consts import *
-from microsoftteams_webhook import create_question_card
 
 
 try:
@@ -56,6 +61,8 @@ def _handle_login_redirect(request, key):
     :return: response authorization_url/admin_consent_url
     """
 
+    from django.http import HttpResponse
+
     asset_id = request.GET.get("asset_id")
     if not asset_id:
         return HttpResponse("ERROR: Asset ID not found in URL", content_type="text/plain", status=400)
@@ -80,7 +87,9 @@ def _get_error_message_from_exception(e, app_connector):
     error_code = None
     error_message = ERROR_MSG_UNAVAILABLE
 
-    app_connector.error_print("Error occurred.", e)
+    # Module level helpers shared with the webhook are called without a connector
+    if app_connector:
+        app_connector.error_print("Error occurred.", e)
 
     try:
         if hasattr(e, "args"):
@@ -90,7 +99,8 @@ def _get_error_message_from_exception(e, app_connector):
             elif len(e.args) == 1:
                 error_message = e.args[0]
     except Exception as e:
-        app_connector.error_print(f"Error occurred while fetching exception information. Details: {e!s}")
+        if app_connector:
+            app_connector.error_print(f"Error occurred while fetching exception information. Details: {e!s}")
 
     if not error_code:
         error_text = f"Error Message: {error_message}"
@@ -100,37 +110,150 @@ def _get_error_message_from_exception(e, app_connector):
     return error_text
 
 
-def _load_app_state(asset_id, app_connector=None):
-    """This function is used to load the current state file.
+def _get_app_file_path(asset_id, file_name):
+    """This function is used to get the path of an asset specific file in the app directory.
 
     :param asset_id: asset_id
-    :param app_connector: Object of app_connector class
-    :return: state: Current state file as a dictionary
+    :param file_name: Name of the file, prefixed with the asset_id
+    :return: path: Absolute path of the file or None if the asset_id is invalid
     """
 
     asset_id = str(asset_id)
     if not asset_id or not asset_id.isalnum():
-        if app_connector:
-            app_connector.debug_print("In _load_app_state: Invalid asset_id")
-        return {}
+        return None
 
     app_dir = os.path.dirname(os.path.abspath(__file__))
-    state_file = f"{app_dir}/{asset_id}_state.json"
-    real_state_file_path = os.path.abspath(state_file)
-    if not os.path.dirname(real_state_file_path) == app_dir:
+    real_file_path = os.path.abspath(f"{app_dir}/{asset_id}_{file_name}")
+    if not os.path.dirname(real_file_path) == app_dir:
+        return None
+
+    return real_file_path
+
+
+def _load_app_file(asset_id, file_name, app_connector=None):
+    """This function is used to load an asset specific JSON file from the app directory.
+
+    :param asset_id: asset_id
+    :param file_name: Name of the file, prefixed with the asset_id
+    :param app_connector: Object of app_connector class
+    :return: data: Content of the file as a dictionary
+    """
+
+    real_file_path = _get_app_file_path(asset_id, file_name)
+    if not real_file_path:
         if app_connector:
-            app_connector.debug_print("In _load_app_state: Invalid asset_id")
+            app_connector.debug_print(f"In _load_app_file: Invalid asset_id for {file_name}")
         return {}
 
-    state = {}
+    data = {}
     try:
-        with open(real_state_file_path) as state_file_obj:
-            state_file_data = state_file_obj.read()
-            state = json.loads(state_file_data)
+        with open(real_file_path) as file_obj:
+            data = json.loads(file_obj.read())
     except Exception as e:
         if app_connector:
             error_text = _get_error_message_from_exception(e, app_connector)
-            app_connector.debug_print(f"In _load_app_state: {error_text}")
+            app_connector.debug_print(f"In _load_app_file: {error_text}")
+
+    return data
+
+
+def _save_app_file(data, asset_id, file_name, app_connector=None):
+    """This function is used to save an asset specific JSON file in the app directory.
+
+    :param data: Dictionary which contains data to write in the file
+    :param asset_id: asset_id
+    :param file_name: Name of the file, prefixed with the asset_id
+    :param app_connector: Object of app_connector class
+    :return: status: phantom.APP_SUCCESS|phantom.APP_ERROR
+    """
+
+    real_file_path = _get_app_file_path(asset_id, file_name)
+    if not real_file_path:
+        if app_connector:
+            app_connector.debug_print(f"In _save_app_file: Invalid asset_id for {file_name}")
+        return {}
+
+    try:
+        # Write a temporary file and rename it over the file, so readers never see a partially written file
+        file_mode = os.stat(real_file_path).st_mode & 0o777 if os.path.exists(real_file_path) else 0o644
+        temp_fd, temp_file_path = tempfile.mkstemp(dir=os.path.dirname(real_file_path), prefix=f".{os.path.basename(real_file_path)}.")
+        try:
+            with os.fdopen(temp_fd, "w") as file_obj:
+                file_obj.write(json.dumps(data))
+            os.chmod(temp_file_path, file_mode)
+            os.replace(temp_file_path, real_file_path)
+        except Exception:
+            os.unlink(temp_file_path)
+            raise
+    except PermissionError:
+        # The app directory may not be writable even though the file is, so fall back to writing the file in place
+        try:
+            with open(real_file_path, "w+") as file_obj:
+                file_obj.write(json.dumps(data))
+        except Exception as e:
+            return _report_app_file_error(e, file_name, app_connector)
+    except Exception as e:
+        return _report_app_file_error(e, file_name, app_connector)
+
+    return phantom.APP_SUCCESS
+
+
+def _report_app_file_error(e, file_name, app_connector=None):
+    """This function is used to report an error while saving an asset specific file.
+
+    :param e: Exception object
+    :param file_name: Name of the file
+    :param app_connector: Object of app_connector class
+    :return: status: phantom.APP_ERROR
+    """
+
+    error_text = _get_error_message_from_exception(e, app_connector)
+    if app_connector:
+        app_connector.debug_print(f"Unable to save {file_name} file: {error_text}")
+    print(f"Unable to save {file_name} file: {error_text}")
+    return phantom.APP_ERROR
+
+
+@contextmanager
+def _lock_app_file(asset_id, file_name):
+    """This context manager is used to hold an exclusive lock on an asset specific file across processes.
+
+    The lock is advisory and taken on a separate lock file, so it survives the file being replaced.
+    If the lock file cannot be opened, the block runs without the lock.
+
+    :param asset_id: asset_id
+    :param file_name: Name of the file to lock, prefixed with the asset_id
+    """
+
+    lock_file_path = _get_app_file_path(asset_id, f"{file_name}.lock")
+    lock_file = None
+    if lock_file_path:
+        try:
+            lock_file = open(lock_file_path, "a")
+        except OSError:
+            lock_file = None
+
+    if lock_file is None:
+        yield
+        return
+
+    with lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _load_app_state(asset_id, app_connector=None):
+    """This function is used to load the current state file.
+
+    :param asset_id: asset_id
+    :param app_connector: Object of app_connector class
+    :return: state: Current state file as a dictionary
+    """
+
+    state = _load_app_file(asset_id, MSTEAMS_STATE_FILE, app_connector)
 
     if app_connector:
         app_connector.debug_print("Loaded state: ", state)
@@ -144,38 +267,13 @@ def _save_app_state(state, asset_id, app_connector=None):
     :param state: Dictionary which contains data to write in state file
     :param asset_id: asset_id
     :param app_connector: Object of app_connector class
-    :return: status: phantom.APP_SUCCESS|phantom.APP_ERROR
+    :return: status phantom.APP_SUCCESS|phantom.APP_ERROR
     """
 
-    asset_id = str(asset_id)
-    if not asset_id or not asset_id.isalnum():
-        if app_connector:
-            app_connector.debug_print("In _save_app_state: Invalid asset_id")
-        return {}
-
-    app_dir = os.path.split(__file__)[0]
-    state_file = f"{app_dir}/{asset_id}_state.json"
-
-    real_state_file_path = os.path.abspath(state_file)
-    if not os.path.dirname(real_state_file_path) == app_dir:
-        if app_connector:
-            app_connector.debug_print("In _save_app_state: Invalid asset_id")
-        return {}
-
     if app_connector:
         app_connector.debug_print("Saving state: ", state)
 
-    try:
-        with open(real_state_file_path, "w+") as state_file_obj:
-            state_file_obj.write(json.dumps(state))
-    except Exception as e:
-        error_text = _get_error_message_from_exception(e, app_connector)
-        if app_connector:
-            app_connector.debug_print(f"Unable to save state file: {error_text}")
-        print(f"Unable to save state file: {error_text}")
-        return phantom.APP_ERROR
-
-    return phantom.APP_SUCCESS
+    return _save_app_file(state, asset_id, MSTEAMS_STATE_FILE, app_connector)
 
 
 def _handle_login_response(request):
@@ -185,6 +283,8 @@ def _handle_login_response(request):
     :return: HttpResponse. The response displayed on authorization URL page
     """
 
+    from django.http import HttpResponse
+
     asset_id = request.GET.get("state")
     if not asset_id:
         return HttpResponse(f"ERROR: Asset ID not found in URL\n{json.dumps(request.GET)}", content_type="text/plain", status=400)
@@ -207,8 +307,6 @@ def _handle_login_response(request):
     if not (code or admin_consent):
         return HttpResponse(f"Error while authenticating\n{json.dumps(request.GET)}", content_type="text/plain", status=400)
 
-    state = _load_app_state(asset_id)
-
     # If value of admin_consent is available
     if admin_consent:
         if admin_consent == "True":
@@ -216,8 +314,10 @@ def _handle_login_response(request):
         else:
             admin_consent = False
 
-        state["admin_consent"] = admin_consent
-        _save_app_state(state, asset_id, None)
+        with _lock_app_file(asset_id, MSTEAMS_STATE_FILE):
+            state = _load_app_state(asset_id)
+            state["admin_consent"] = admin_consent
+            _save_app_state(state, asset_id, None)
 
         # If admin_consent is True
         if admin_consent:
@@ -225,17 +325,42 @@ def _handle_login_response(request):
         return HttpResponse("Admin Consent declined. Please close this window and try again later.", content_type="text/plain", status=400)
 
     # If value of admin_consent is not available, value of code is available
-    state["code"] = code
     try:
-        state["code"] = MicrosoftTeamConnector().encrypt_state(code, "code")
-        state[MSTEAMS_STATE_IS_ENCRYPTED] = True
+        encrypted_code = MicrosoftTeamConnector().encrypt_state(code, "code")
     except Exception as e:
         return HttpResponse(f"{MSTEAMS_ENCRYPTION_ERROR}: {e!s}", content_type="text/plain", status=400)
-    _save_app_state(state, asset_id, None)
+
+    with _lock_app_file(asset_id, MSTEAMS_STATE_FILE):
+        state = _load_app_state(asset_id)
+        state["code"] = encrypted_code
+        state[MSTEAMS_STATE_IS_ENCRYPTED] = True
+        _save_app_state(state, asset_id, None)
 
     return HttpResponse("Code received. Please close this window, the action will continue to get new token.", content_type="text/plain")
 
 
+def _notify_auth_waiter(fifo_path):
+    """Wake up the action waiting for the authorization, if any.
+
+    :param fifo_path: Path of the FIFO the waiting action listens on
+    """
+
+    try:
+        if not stat.S_ISFIFO(os.stat(fifo_path).st_mode):
+            return
+        fifo_fd = os.open(fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+    except OSError:
+        # No action is listening, it will find the status file on its own
+        return
+
+    try:
+        os.write(fifo_fd, b"1")
+    except OSError:
+        pass
+    finally:
+        os.close(fifo_fd)
+
+
 def _handle_rest_request(request, path_parts):
     """Handle requests for authorization.
 
@@ -244,6 +369,9 @@ def _handle_rest_request(request, path_parts):
     :return: dictionary containing response parameters
     """
 
+    # Django is only available to, and needed by, the REST handler
+    from django.http import HttpResponse
+
     if len(path_parts) < 2:
         return HttpResponse("error: True, message: Invalid REST endpoint request", content_type="text/plain", status=404)
 
@@ -275,6 +403,7 @@ def _handle_rest_request(request, path_parts):
                 os.chmod(auth_status_file_path, "0664")
             except Exception:
                 pass
+            _notify_auth_waiter(f"{app_dir}/{asset_id}_{MSTEAMS_TC_FIFO}")
 
         return return_val
     return HttpResponse("error: Invalid endpoint", content_type="text/plain", status=404)
@@ -311,14 +440,55 @@ class MicrosoftTeamConnector(BaseConnector):
         self._refresh_token = None
         self.asset_id = self.get_asset_id()
         self._scope = None
+        self._session = None
+        self._session_lock = threading.Lock()
+        # The status code of the last REST call is kept per thread, so concurrent calls do not see each other's status
+        self._request_context = threading.local()
+        self._bytes_received = 0
+        self._bytes_lock = threading.Lock()
+        self._token_expires_on = None
+        self._token_refresh_skew = MSTEAMS_DEFAULT_TOKEN_REFRESH_SKEW
+        self._token_lock = threading.Lock()
+        self._channel_cache = None
+        self._channel_cache_dirty = False
+        self._channel_cache_ttl = MSTEAMS_DEFAULT_CHANNEL_CACHE_TTL
+        self._user_index = None
+        self._user_index_dirty = False
+        self._message_timestamps = {}
+        self._max_retries = MSTEAMS_DEFAULT_MAX_RETRIES
+        self._retry_deadline = MSTEAMS_DEFAULT_RETRY_DEADLINE
+        self._retry_wait_time = 0.0
+        self._retry_lock = threading.Lock()
+        self._bot_access_token = None
+        self._state_snapshot = None
+        self._token_ciphertexts = {}
+
+    @property
+    def _last_status_code(self) -> Optional[int]:
+        """Status code of the last REST call made by the current thread."""
+
+        return getattr(self._request_context, "status_code", None)
+
+    @_last_status_code.setter
+    def _last_status_code(self, status_code):
+        self._request_context.status_code = status_code
 
     def encrypt_state(self, encrypt_var, token_name):
         """Handle encryption of token.
+
+        A token that is unchanged since it was last encrypted or decrypted during the run is not encrypted again.
+
         :param encrypt_var: Variable needs to be encrypted
         :return: encrypted variable
         """
+        plain_var, encrypted_var = self._token_ciphertexts.get(token_name, (None, None))
+        if encrypted_var and plain_var == encrypt_var:
+            return encrypted_var
+
         self.debug_print(MSTEAMS_ENCRYPT_TOKEN.format(token_name))  # nosemgrep
-        return encryption_helper.encrypt(encrypt_var, self.asset_id)
+        encrypted_var = encryption_helper.encrypt(encrypt_var, self.asset_id)
+        self._token_ciphertexts[token_name] = (encrypt_var, encrypted_var)
+        return encrypted_var
 
     def decrypt_state(self, decrypt_var, token_name):
         """Handle decryption of token.
@@ -326,7 +496,9 @@ class MicrosoftTeamConnector(BaseConnector):
         :return: decrypted variable
         """
         self.debug_print(MSTEAMS_DECRYPT_TOKEN.format(token_name))  # nosemgrep
-        return encryption_helper.decrypt(decrypt_var, self.asset_id)
+        decrypted_var = encryption_helper.decrypt(decrypt_var, self.asset_id)
+        self._token_ciphertexts[token_name] = (decrypted_var, decrypt_var)
+        return decrypted_var
 
     def _process_empty_response(self, response, action_result):
         """This function is used to process empty response.
@@ -353,6 +525,8 @@ class MicrosoftTeamConnector(BaseConnector):
         :return: status phantom.APP_ERROR/phantom.APP_SUCCESS(along with appropriate message)
         """
 
+        from bs4 import BeautifulSoup
+
         # An html response, treat it like an error
         status_code = response.status_code
 
@@ -461,34 +635,33 @@ class MicrosoftTeamConnector(BaseConnector):
 
         if endpoint.startswith(MSTEAMS_MSGRAPH_TEAMS_ENDPOINT):
             endpoint = f"{MSTEAMS_MSGRAPH_BETA_API_BASE_URL}{endpoint}"
-        elif not endpoint.startswith(MSTEAMS_MSGRAPH_API_BASE_URL):
+        elif not endpoint.startswith((MSTEAMS_MSGRAPH_API_BASE_URL, MSTEAMS_MSGRAPH_BETA_API_BASE_URL)):
             endpoint = f"{MSTEAMS_MSGRAPH_API_BASE_URL}{endpoint}"
 
         if headers is None:
             headers = {}
 
-        self._client_id = urllib.quote(self._client_id)
-        self._tenant = urllib.quote(self._tenant)
-        token_data = {
-            "client_id": self._client_id,
-            "scope": self._scope,
-            "client_secret": self._client_secret,
-            "grant_type": MSTEAMS_REFRESH_TOKEN_STRING,
-            "refresh_token": self._refresh_token,
-        }
-
         if not self._access_token:
             if not self._refresh_token:
                 # If none of the access_token and refresh_token is available
                 return action_result.set_status(phantom.APP_ERROR, status_message=MSTEAMS_TOKEN_NOT_AVAILABLE_MSG), None
 
             # If refresh_token is available and access_token is not available, generate new access_token
-            status = self._generate_new_access_token(action_result=action_result, data=token_data)
+            status = self._refresh_access_token(action_result, self._access_token)
 
             if phantom.is_fail(status):
                 return action_result.get_status(), None
 
-        headers.update({"Authorization": f"Bearer {self._access_token}", "Accept": "application/json", "Content-Type": "application/json"})
+        elif self._refresh_token and self._is_access_token_expiring():
+            # Refresh ahead of the stored expiry instead of waiting for Graph to reject the token
+            self.debug_print(MSTEAMS_TOKEN_EXPIRING_MSG)
+            status = self._refresh_access_token(action_result, self._access_token)
+
+            if phantom.is_fail(status):
+                return action_result.get_status(), None
+
+        access_token = self._access_token
+        headers.update({"Authorization": f"Bearer {access_token}", "Accept": "application/json", "Content-Type": "application/json"})
 
         status, resp_json = self._make_rest_call(
             action_result=action_result, endpoint=endpoint, headers=headers, params=params, data=data, method=method
@@ -500,7 +673,7 @@ class MicrosoftTeamConnector(BaseConnector):
             # If token is expired, generate new token
             if self._is_token_expired(action_result_message):
                 self.debug_print(MSTEAMS_TOKEN_EXPIRED_MSG)
-                status = self._generate_new_access_token(action_result=action_result, data=token_data)
+                status = self._refresh_access_token(action_result, access_token)
 
                 if phantom.is_fail(status):
                     return action_result.get_status(), None
@@ -521,6 +694,227 @@ class MicrosoftTeamConnector(BaseConnector):
     def _is_token_expired(self, action_result_message: str) -> bool:
         return MSTEAMS_TOKEN_EXPIRED_MARKER in action_result_message
 
+    def _is_access_token_expiring(self) -> bool:
+        """Check whether the access token expires within the configured refresh skew.
+
+        :return: True if the stored expiry is known and falls within the refresh skew, False otherwise
+        """
+
+        if not self._token_expires_on:
+            return False
+
+        return time.time() + self._token_refresh_skew >= self._token_expires_on
+
+    def _refresh_access_token(self, action_result, stale_access_token) -> bool:
+        """This function is used to generate new access token using the refresh token.
+
+        :param action_result: object of ActionResult class
+        :param stale_access_token: access token that needs to be replaced
+        :return: status phantom.APP_ERROR/phantom.APP_SUCCESS
+        """
+
+        with self._token_lock:
+            # Another worker thread has already replaced the stale token
+            if self._access_token and self._access_token != stale_access_token:
+                return phantom.APP_SUCCESS
+
+            return self._redeem_refresh_token(action_result)
+
+    def _redeem_refresh_token(self, action_result) -> bool:
+        """This function is used to request new access token from the refresh token grant.
+
+        :param action_result: object of ActionResult class
+        :return: status phantom.APP_ERROR/phantom.APP_SUCCESS
+        """
+
+        self._client_id = urllib.quote(self._client_id)
+        self._tenant = urllib.quote(self._tenant)
+        token_data = {
+            "client_id": self._client_id,
+            "scope": self._scope,
+            "client_secret": self._client_secret,
+            "grant_type": MSTEAMS_REFRESH_TOKEN_STRING,
+            "refresh_token": self._refresh_token,
+        }
+
+        return self._generate_new_access_token(action_result=action_result, data=token_data)
+
+    def _validate_integer(self, action_result, parameter, key, allow_zero=False):
+        """Validate an integer.
+
+        :param action_result: Action result or BaseConnector object
+        :param parameter: input parameter
+        :param key: input parameter message key
+        :param allow_zero: whether zero should be considered as valid value or not
+        :return: status phantom.APP_ERROR/phantom.APP_SUCCESS, integer value of the parameter or None in case of failure
+        """
+
+        if parameter is not None:
+            try:
+                if not float(parameter).is_integer():
+                    return action_result.set_status(phantom.APP_ERROR, MSTEAMS_VALID_INT_MSG.format(param=key)), None
+
+                parameter = int(parameter)
+            except Exception:
+                return action_result.set_status(phantom.APP_ERROR, MSTEAMS_VALID_INT_MSG.format(param=key)), None
+
+            if parameter < 0:
+                return action_result.set_status(phantom.APP_ERROR, MSTEAMS_NON_NEG_INT_MSG.format(param=key)), None
+            if not allow_zero and parameter == 0:
+                return action_result.set_status(phantom.APP_ERROR, MSTEAMS_NON_NEG_NON_ZERO_INT_MSG.format(param=key)), None
+
+        return phantom.APP_SUCCESS, parameter
+
+    def _get_batch_sub_request(self, request_id, request) -> tuple[str, dict]:
+        """Build a JSON batch sub-request from a relative or absolute Graph request.
+
+        Graph only accepts sub-requests of the API version of the batch endpoint, so the version of an absolute URL
+        selects the batch endpoint the sub-request is sent to, and relative URLs use v1.0.
+
+        :param request_id: ID used to map the sub-response back to the request
+        :param request: Dictionary containing method, url and optional body and headers of the request
+        :return: URL of the batch endpoint to use, dictionary containing the JSON batch sub-request
+        """
+
+        url = request["url"]
+        api_base_url = MSTEAMS_MSGRAPH_API_BASE_URL
+        for base_url in (MSTEAMS_MSGRAPH_API_BASE_URL, MSTEAMS_MSGRAPH_BETA_API_BASE_URL):
+            if url.startswith(f"{base_url}/"):
+                api_base_url = base_url
+                url = url[len(base_url) :]
+                break
+
+        sub_request = {"id": request_id, "method": request.get("method", "GET").upper(), "url": url}
+        headers = dict(request.get("headers") or {})
+        if request.get("body") is not None:
+            sub_request["body"] = request["body"]
+            headers.setdefault("Content-Type", "application/json")
+        if headers:
+            sub_request["headers"] = headers
+
+        return f"{api_base_url}{MSTEAMS_MSGRAPH_BATCH_ENDPOINT}", sub_request
+
+    def _send_batch_chunk(self, action_result, batch_url, sub_requests) -> dict:
+        """Send up to MSTEAMS_BATCH_MAX_REQUESTS sub-requests in one JSON batch call.
+
+        If the batch call itself fails, the chunk is split in halves and each half is sent again,
+        so that a single bad sub-request does not fail the others.
+
+        :param action_result: object of ActionResult class
+        :param batch_url: URL of the batch endpoint of the API version of the sub-requests
+        :param sub_requests: List of JSON batch sub-requests
+        :return: Dictionary of sub-request ID to sub-response
+        """
+
+        data = json.dumps({"requests": sub_requests})
+        status, response = self._update_request(action_result=action_result, endpoint=batch_url, method="post", data=data)
+
+        if phantom.is_fail(status):
+            # Only a malformed sub-request can make Graph reject the whole batch, so retry the halves separately
+            if len(sub_requests) == 1 or self._last_status_code not in MSTEAMS_BATCH_SPLIT_STATUS_CODES:
+                error_body = {"error": {"message": action_result.get_message()}}
+                return {
+                    sub_request["id"]: {"id": sub_request["id"], "status": self._last_status_code, "body": error_body}
+                    for sub_request in sub_requests
+                }
+
+            middle = len(sub_requests) // 2
+            sub_responses = self._send_batch_chunk(action_result, batch_url, sub_requests[:middle])
+            sub_responses.update(self._send_batch_chunk(action_result, batch_url, sub_requests[middle:]))
+            return sub_responses
+
+        return {sub_response.get("id"): sub_response for sub_response in response.get("responses", [])}
+
+    def _get_batch_retry_after(self, sub_response) -> int:
+        """Get the number of seconds to wait before retrying a throttled sub-request.
+
+        :param sub_response: Dictionary containing the JSON batch sub-response
+        :return: number of seconds to wait
+        """
+
+        headers = {key.lower(): value for key, value in (sub_response.get("headers") or {}).items()}
+        retry_after = self._get_retry_after(headers.get("retry-after"))
+        if retry_after is None:
+            retry_after = MSTEAMS_BATCH_DEFAULT_RETRY_AFTER
+
+        return min(retry_after, MSTEAMS_BATCH_MAX_RETRY_AFTER)
+
+    def _make_batch_request(self, requests_list, max_workers=1) -> list:
+        """Send independent Graph requests through the JSON batch endpoint, 20 sub-requests per call.
+
+        Throttled or unavailable sub-requests are retried after the Retry-After interval returned by Graph,
+        and only idempotent sub-requests are retried on a gateway timeout, which may hide a processed request.
+
+        :param requests_list: List of dictionaries containing method, url and optional body and headers
+        :param max_workers: Maximum number of batch calls sent concurrently
+        :return: List of sub-responses in the same order as requests_list
+        """
+
+        sub_requests = {}
+        batch_urls = {}
+        for index, request in enumerate(requests_list):
+            batch_urls[str(index)], sub_requests[str(index)] = self._get_batch_sub_request(str(index), request)
+
+        sub_responses = {}
+        pending = list(sub_requests.keys())
+
+        for attempt in range(MSTEAMS_BATCH_MAX_RETRIES + 1):
+            chunks = []
+            for batch_url in dict.fromkeys(batch_urls[request_id] for request_id in pending):
+                batch_url_pending = [request_id for request_id in pending if batch_urls[request_id] == batch_url]
+                for start in range(0, len(batch_url_pending), MSTEAMS_BATCH_MAX_REQUESTS):
+                    chunk = [sub_requests[request_id] for request_id in batch_url_pending[start : start + MSTEAMS_BATCH_MAX_REQUESTS]]
+                    chunks.append((batch_url, chunk))
+
+            retry_ids = []
+            retry_after = 0
+
+            # Each batch call records its status in its own action result, as it may run in a worker thread
+            for chunk_responses in self._run_concurrently(lambda chunk: self._send_batch_chunk(ActionResult(), *chunk), chunks, max_workers):
+                for request_id, sub_response in chunk_responses.items():
+                    if request_id not in sub_requests:
+                        continue
+                    sub_responses[request_id] = sub_response
+                    if attempt < MSTEAMS_BATCH_MAX_RETRIES and self._is_batch_retryable(sub_requests[request_id], sub_response):
+                        retry_ids.append(request_id)
+                        retry_after = max(retry_after, self._get_batch_retry_after(sub_response))
+
+            if not retry_ids:
+                break
+
+            self.debug_print(f"Retrying {len(retry_ids)} throttled batch sub-request(s) after {retry_after} second(s)")
+            self._wait_before_retry(retry_after)
+            pending = retry_ids
+
+        return [sub_responses.get(request_id, {"id": request_id, "status": None, "body": None}) for request_id in sub_requests]
+
+    def _is_batch_retryable(self, sub_request, sub_response) -> bool:
+        """Check whether a failed sub-request can be sent again.
+
+        :param sub_request: Dictionary containing the JSON batch sub-request
+        :param sub_response: Dictionary containing the JSON batch sub-response
+        :return: True if the sub-request was throttled, or timed out and is idempotent, False otherwise
+        """
+
+        status_code = sub_response.get("status")
+        if status_code in MSTEAMS_THROTTLE_STATUS_CODES:
+            return True
+
+        return status_code in MSTEAMS_BATCH_RETRY_STATUS_CODES and sub_request["method"].lower() in MSTEAMS_IDEMPOTENT_METHODS
+
+    def _get_batch_error_message(self, sub_response) -> str:
+        """Get the error message of a failed JSON batch sub-response.
+
+        :param sub_response: Dictionary containing the JSON batch sub-response
+        :return: error message
+        """
+
+        body = sub_response.get("body")
+        if isinstance(body, dict) and isinstance(body.get("error"), dict) and body["error"].get("message"):
+            return body["error"]["message"]
+
+        return f"Request failed with status code {sub_response.get('status')}"
+
     def _get_oauth_config_hash(self):
         config = self.get_config()
         oauth_config = {
@@ -537,8 +931,96 @@ class MicrosoftTeamConnector(BaseConnector):
 
     def _save_oauth_config_hash(self):
         self._state[MSTEAMS_OAUTH_CONFIG_HASH] = self._get_oauth_config_hash()
-        self.save_state(self._state)
-        _save_app_state(self._state, self.get_asset_id(), self)
+        self._save_state()
+
+    def _take_state_snapshot(self):
+        """This function is used to remember the state as last loaded or saved, to detect the changes made during the run."""
+
+        self._state_snapshot = json.dumps(self._state, sort_keys=True)
+
+    def _save_state(self):
+        """This function is used to save the keys of the state changed during the run, if any, in a single write.
+
+        The state is reloaded under an exclusive lock and only the changed keys are applied to it, so that concurrent runs
+        on the same asset do not overwrite each other's changes.
+
+        :return: status phantom.APP_SUCCESS/phantom.APP_ERROR
+        """
+
+        if self._state_snapshot is not None and json.dumps(self._state, sort_keys=True) == self._state_snapshot:
+            self.debug_print("State unchanged, skipping save")
+            return phantom.APP_SUCCESS
+
+        snapshot = json.loads(self._state_snapshot) if self._state_snapshot else {}
+        asset_id = self.get_asset_id()
+
+        with _lock_app_file(asset_id, MSTEAMS_STATE_FILE):
+            state = self.load_state()
+            if not isinstance(state, dict):
+                state = {}
+
+            for key in set(snapshot) | set(self._state):
+                if key not in self._state:
+                    state.pop(key, None)
+                elif key not in snapshot or self._state[key] != snapshot[key]:
+                    state[key] = self._state[key]
+
+            self.save_state(state)
+            ret_val = _save_app_state(state, asset_id, self)
+
+        self._state = state
+        self._take_state_snapshot()
+        return ret_val
+
+    def _get_session(self) -> requests.Session:
+        """Get the keep-alive HTTP session shared by all the REST calls of this connector run.
+
+        :return: requests.Session object with a sized connection pool
+        """
+
+        # The first REST calls of the concurrent actions are made from worker threads, so only one of them may create the session
+        with self._session_lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=MSTEAMS_HTTP_POOL_CONNECTIONS, pool_maxsize=MSTEAMS_HTTP_POOL_MAXSIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                self._session = session
+
+        return self._session
+
+    def _get_session_stats(self) -> dict:
+        """Get the number of requests sent and connections opened by the HTTP session.
+
+        :return: dictionary containing request, connection and reused connection counts
+        """
+
+        stats = {"requests": 0, "connections": 0, "reused_connections": 0}
+        if self._session is None:
+            return stats
+
+        pool_managers = {id(adapter.poolmanager): adapter.poolmanager for adapter in self._session.adapters.values()}
+        for pool_manager in pool_managers.values():
+            for pool_key in pool_manager.pools.keys():
+                pool = pool_manager.pools.get(pool_key)
+                if pool is None:
+                    continue
+                stats["requests"] += pool.num_requests
+                stats["connections"] += pool.num_connections
+
+        stats["reused_connections"] = max(stats["requests"] - stats["connections"], 0)
+        return stats
+
+    def _close_session(self):
+        """Log the connection reuse counts and close the HTTP session."""
+
+        if self._session is None:
+            return
+
+        stats = self._get_session_stats()
+        self.debug_print(MSTEAMS_HTTP_SESSION_STATS_MSG.format(**stats))
+        self._session.close()
+        self._session = None
 
     def _make_rest_call(
         self, endpoint, action_result, headers=None, params=None, data=None, method="get", verify=True
@@ -557,18 +1039,112 @@ class MicrosoftTeamConnector(BaseConnector):
         """
 
         resp_json = None
+        self._last_status_code = None
 
         try:
-            request_func = getattr(requests, method)
+            request_func = getattr(self._get_session(), method)
         except AttributeError:
             return RetVal(action_result.set_status(phantom.APP_ERROR, f"Invalid method: {method}"), resp_json)
+
+        # Server errors and dropped connections may hide a processed request, so only idempotent requests are retried on them
+        retry_on_error = method in MSTEAMS_IDEMPOTENT_METHODS
+        # Each request has its own retry budget, so concurrent requests and long paginations do not use up each other's retries
+        retry_deadline = time.monotonic() + self._retry_deadline
+        attempt = 0
+        while True:
+            try:
+                r = request_func(endpoint, data=data, headers=headers, verify=verify, params=params, timeout=MSTEAMS_DEFAULT_TIMEOUT)
+            except requests.exceptions.ConnectionError as e:
+                wait = self._get_backoff(attempt)
+                if retry_on_error and self._can_retry(attempt, wait, retry_deadline):
+                    self.debug_print(MSTEAMS_RETRY_MSG.format(url=endpoint, reason=type(e).__name__, wait=wait))
+                    self._wait_before_retry(wait)
+                    attempt += 1
+                    continue
+                error_text = _get_error_message_from_exception(e, self)
+                return RetVal(action_result.set_status(phantom.APP_ERROR, f"Error connecting to server. {error_text}"), resp_json)
+            except Exception as e:
+                error_text = _get_error_message_from_exception(e, self)
+                return RetVal(action_result.set_status(phantom.APP_ERROR, f"Error connecting to server. {error_text}"), resp_json)
+
+            self._last_status_code = r.status_code
+            response_size = self._get_response_size(r)
+            with self._bytes_lock:
+                self._bytes_received += response_size
+
+            if r.status_code in MSTEAMS_THROTTLE_STATUS_CODES or (retry_on_error and r.status_code in MSTEAMS_RETRY_STATUS_CODES):
+                wait = self._get_retry_after(r.headers.get("Retry-After"))
+                wait = self._get_backoff(attempt) if wait is None else min(wait, MSTEAMS_MAX_RETRY_AFTER)
+                if self._can_retry(attempt, wait, retry_deadline):
+                    self.debug_print(MSTEAMS_RETRY_MSG.format(url=endpoint, reason=f"HTTP {r.status_code}", wait=wait))
+                    r.close()
+                    self._wait_before_retry(wait)
+                    attempt += 1
+                    continue
+
+            return self._process_response(r, action_result)
+
+    def _get_retry_after(self, retry_after) -> Optional[float]:
+        """Parse a Retry-After header given either in seconds or as an HTTP date.
+
+        :param retry_after: value of the Retry-After header
+        :return: number of seconds to wait, None if the header is missing or invalid
+        """
+
+        if retry_after is None:
+            return None
+
         try:
-            r = request_func(endpoint, data=data, headers=headers, verify=verify, params=params, timeout=MSTEAMS_DEFAULT_TIMEOUT)
-        except Exception as e:
-            error_text = _get_error_message_from_exception(e, self)
-            return RetVal(action_result.set_status(phantom.APP_ERROR, f"Error connecting to server. {error_text}"), resp_json)
+            return max(float(retry_after), 0)
+        except (TypeError, ValueError):
+            pass
+
+        try:
+            return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0)
+        except (TypeError, ValueError):
+            return None
+
+    def _get_backoff(self, attempt) -> float:
+        """Get the exponential backoff with full jitter for a retry attempt.
+
+        :param attempt: number of retries already made for the request
+        :return: number of seconds to wait
+        """
+
+        return random.uniform(0, min(MSTEAMS_RETRY_BACKOFF_BASE * 2**attempt, MSTEAMS_RETRY_BACKOFF_MAX))
+
+    def _can_retry(self, attempt, wait, retry_deadline) -> bool:
+        """Check whether a request can be retried within its retry budget.
+
+        :param attempt: number of retries of the request so far
+        :param wait: number of seconds to wait before the retry
+        :param retry_deadline: time.monotonic() value past which the request is no longer retried
+        :return: True if the retry is within the maximum number of retries and before the deadline, False otherwise
+        """
+
+        return attempt < self._max_retries and time.monotonic() + wait <= retry_deadline
+
+    def _wait_before_retry(self, wait):
+        """Sleep before retrying a request and record the time spent waiting.
+
+        :param wait: number of seconds to wait
+        """
+
+        time.sleep(wait)
+        with self._retry_lock:
+            self._retry_wait_time += wait
+
+    def _get_response_size(self, response) -> int:
+        """Get the number of body bytes read from the wire for a response, before decompression.
+
+        :param response: response data
+        :return: number of bytes
+        """
 
-        return self._process_response(r, action_result)
+        try:
+            return int(response.raw.tell())
+        except Exception:
+            return len(response.content or b"")
 
     def _get_asset_name(self, action_result):
         """Get name of the asset using Phantom URL.
@@ -587,7 +1163,7 @@ class MicrosoftTeamConnector(BaseConnector):
 
         asset_name = resp_json.get("name")
         if not asset_name:
-            return action_result.set_status(phantom.APP_ERROR, f"Asset Name for id: {asset_id} not found.", None)
+            return action_result.set_status(phantom.APP_ERROR, f"Asset Name for id: {asset_id} not found."), None
         return phantom.APP_SUCCESS, asset_name
 
     def _get_phantom_base_url_ms(self, action_result):
@@ -613,25 +1189,54 @@ class MicrosoftTeamConnector(BaseConnector):
     def _get_app_rest_url(self, action_result):
         """Get URL for making rest calls.
 
+        The URL is cached in the state for the asset and app, and the asset name is looked up again to revalidate it,
+        as the URL changes when the asset is renamed.
+
         :param action_result: object of ActionResult class
         :return: status phantom.APP_ERROR/phantom.APP_SUCCESS(along with appropriate message),
         URL to make rest calls
         """
 
-        ret_val, phantom_base_url = self._get_phantom_base_url_ms(action_result)
-        if phantom.is_fail(ret_val):
-            return action_result.get_status(), None
+        asset_id = self.get_asset_id()
+        app_json = self.get_app_json()
+        cached_url = self._state.get(MSTEAMS_APP_REST_URL_STRING) or {}
+
+        if (
+            cached_url.get(MSTEAMS_ASSET_ID_STRING) == asset_id
+            and cached_url.get(MSTEAMS_APP_ID_STRING) == app_json["appid"]
+            and cached_url.get(MSTEAMS_BASE_URL_STRING)
+        ):
+            ret_val, asset_name = self._get_asset_name(action_result)
+            if phantom.is_fail(ret_val):
+                return action_result.get_status(), None
 
-        ret_val, asset_name = self._get_asset_name(action_result)
-        if phantom.is_fail(ret_val):
-            return action_result.get_status(), None
+            phantom_base_url = cached_url[MSTEAMS_BASE_URL_STRING]
+            if asset_name == cached_url.get(MSTEAMS_ASSET_NAME_STRING) and cached_url.get(MSTEAMS_URL_STRING):
+                self.save_progress(f"Using Phantom base URL as: {phantom_base_url}")
+                return phantom.APP_SUCCESS, cached_url[MSTEAMS_URL_STRING]
+        else:
+            # Both lookups are independent, so they are made concurrently, each recording its status in its own action result
+            lookups = [(self._get_phantom_base_url_ms, ActionResult()), (self._get_asset_name, ActionResult())]
+            results = self._run_concurrently(lambda lookup: lookup[0](lookup[1]), lookups, len(lookups))
+
+            for (ret_val, _), (_, lookup_action_result) in zip(results, lookups):
+                if phantom.is_fail(ret_val):
+                    return action_result.set_status(phantom.APP_ERROR, lookup_action_result.get_message()), None
+
+            (_, phantom_base_url), (_, asset_name) = results
 
         self.save_progress(f"Using Phantom base URL as: {phantom_base_url}")
-        app_json = self.get_app_json()
         app_name = app_json["name"]
 
         app_dir_name = _get_dir_name_from_app_name(app_name)
         url_to_app_rest = "{}/rest/handler/{}_{}/{}".format(phantom_base_url, app_dir_name, app_json["appid"], asset_name)
+        self._state[MSTEAMS_APP_REST_URL_STRING] = {
+            MSTEAMS_ASSET_ID_STRING: asset_id,
+            MSTEAMS_APP_ID_STRING: app_json["appid"],
+            MSTEAMS_ASSET_NAME_STRING: asset_name,
+            MSTEAMS_BASE_URL_STRING: phantom_base_url,
+            MSTEAMS_URL_STRING: url_to_app_rest,
+        }
         return phantom.APP_SUCCESS, url_to_app_rest
 
     def _generate_new_access_token(self, action_result, data) -> bool:
@@ -651,6 +1256,13 @@ class MicrosoftTeamConnector(BaseConnector):
         self._access_token = resp_json[MSTEAMS_ACCESS_TOKEN_STRING]
         self._refresh_token = resp_json[MSTEAMS_REFRESH_TOKEN_STRING]
 
+        # Store the absolute expiry so that the token can be refreshed before it is rejected
+        try:
+            self._token_expires_on = int(time.time()) + int(resp_json.get(MSTEAMS_EXPIRES_IN_STRING))
+        except (TypeError, ValueError):
+            self._token_expires_on = None
+        resp_json[MSTEAMS_EXPIRES_ON_STRING] = self._token_expires_on
+
         try:
             encrypted_access_token = self.encrypt_state(resp_json[MSTEAMS_ACCESS_TOKEN_STRING], "access")
         except Exception as e:
@@ -668,32 +1280,28 @@ class MicrosoftTeamConnector(BaseConnector):
 
         self._state[MSTEAMS_TOKEN_STRING] = resp_json
         self._state[MSTEAMS_STATE_IS_ENCRYPTED] = True
-        self.save_state(self._state)
-        _save_app_state(self._state, self.get_asset_id(), self)
+        self._save_state()
 
         self._state = self.load_state()
         # Scenario -
         #
         # If the corresponding state file doesn't have correct owner, owner group or permissions,
         # the newly generated token is not being saved to state file and automatic workflow for token has been stopped.
-        # So we have to check that token from response and token which are saved to state file
-        # after successful generation of new token are same or not.
-
-        try:
-            if self._access_token != self.decrypt_state(
-                self._state.get(MSTEAMS_TOKEN_STRING, {}).get(MSTEAMS_ACCESS_TOKEN_STRING), "access"
-            ) or self._refresh_token != self.decrypt_state(
-                self._state.get(MSTEAMS_TOKEN_STRING, {}).get(MSTEAMS_REFRESH_TOKEN_STRING), "refresh"
-            ):
-                message = "Error occurred while saving the newly generated access or "
-                message += "refresh token (in place of the expired token) in the state file."
-                message += " Please check the owner, owner group, and the permissions of the state file. The Phantom "
-                message += "user should have the correct access rights and "
-                message += "ownership for the corresponding state file (refer to readme file for more information)."
-                return action_result.set_status(phantom.APP_ERROR, message)
-        except Exception as e:
-            self.debug_print(f"{MSTEAMS_DECRYPTION_ERROR}: {_get_error_message_from_exception(e, self)}")
-            return action_result.set_status(phantom.APP_ERROR, MSTEAMS_DECRYPTION_ERROR)
+        # So we have to check that the encrypted tokens read back from the state file are the ones just written.
+        # Comparing the ciphertexts is enough, as the tokens were encrypted from the response above.
+
+        stored_token = self._state.get(MSTEAMS_TOKEN_STRING, {}) if isinstance(self._state, dict) else {}
+        if (
+            stored_token.get(MSTEAMS_ACCESS_TOKEN_STRING) != encrypted_access_token
+            or stored_token.get(MSTEAMS_REFRESH_TOKEN_STRING) != encrypted_refresh_token
+        ):
+            message = "Error occurred while saving the newly generated access or "
+            message += "refresh token (in place of the expired token) in the state file."
+            message += " Please check the owner, owner group, and the permissions of the state file. The Phantom "
+            message += "user should have the correct access rights and "
+            message += "ownership for the corresponding state file (refer to readme file for more information)."
+            return action_result.set_status(phantom.APP_ERROR, message)
+        self._take_state_snapshot()
 
         return action_result.set_status(phantom.APP_SUCCESS, status_message=MSTEAMS_TOKEN_GENERATED_MSG)
 
@@ -758,24 +1366,28 @@ class MicrosoftTeamConnector(BaseConnector):
         self.save_progress(MSTEAMS_AUTHORIZE_TROUBLESHOOT_MSG)
         self.save_progress(MSTEAMS_AUTHORIZE_WAIT_MSG)
 
-        time.sleep(MSTEAMS_AUTHORIZE_WAIT_TIME)
-
         # Wait for some while user login to Microsoft
         status = self._wait(action_result=action_result)
 
         if phantom.is_fail(status):
+            # The redirect may have gone to an outdated URL, so look it up again on the next run
+            self._state.pop(MSTEAMS_APP_REST_URL_STRING, None)
             self.save_progress(MSTEAMS_TEST_CONNECTIVITY_FAILED_MSG)
             return action_result.get_status()
 
         # Empty message to override last message of waiting
         self.send_progress("")
         self.save_progress(MSTEAMS_CODE_RECEIVED_MSG)
+        app_rest_url_cache = self._state.get(MSTEAMS_APP_REST_URL_STRING)
         self._state = _load_app_state(self.get_asset_id(), self)
 
         # if code is not available in the state file
         if not self._state or not self._state.get("code"):
             return action_result.set_status(phantom.APP_ERROR, status_message=MSTEAMS_TEST_CONNECTIVITY_FAILED_MSG)
 
+        if app_rest_url_cache:
+            self._state[MSTEAMS_APP_REST_URL_STRING] = app_rest_url_cache
+
         if self._state.get(MSTEAMS_STATE_IS_ENCRYPTED):
             try:
                 current_code = self.decrypt_state(self._state["code"], "code")
@@ -784,8 +1396,7 @@ class MicrosoftTeamConnector(BaseConnector):
                 return action_result.set_status(phantom.APP_ERROR, MSTEAMS_DECRYPTION_ERROR)
         else:
             current_code = self._state["code"]
-        self.save_state(self._state)
-        _save_app_state(self._state, self.get_asset_id(), self)
+        self._save_state()
         self.save_progress(MSTEAMS_GENERATING_ACCESS_TOKEN_MSG)
 
         data = {
@@ -796,6 +1407,10 @@ class MicrosoftTeamConnector(BaseConnector):
             "redirect_uri": redirect_uri,
             "code": current_code,
         }
+        # The authorized user may have changed, so forget the cached identity and chats
+        self._state.pop(MSTEAMS_CURRENT_USER_ID_STRING, None)
+        self._state.pop(MSTEAMS_DIRECT_CHATS_STRING, None)
+
         # for first time access, new access token is generated
         ret_val = self._generate_new_access_token(action_result=action_result, data=data)
 
@@ -817,6 +1432,25 @@ class MicrosoftTeamConnector(BaseConnector):
         self.save_progress(MSTEAMS_TEST_CONNECTIVITY_PASSED_MSG)
         return action_result.set_status(phantom.APP_SUCCESS)
 
+    def _open_auth_fifo(self, fifo_path):
+        """This function is used to create the FIFO on which the REST handler signals a received authorization.
+
+        :param fifo_path: Path of the FIFO
+        :return: file descriptor of the FIFO or None if it could not be created
+        """
+
+        try:
+            if os.path.lexists(fifo_path):
+                os.unlink(fifo_path)
+            os.mkfifo(fifo_path)
+            # The REST handler runs as a different user, and a write only wakes up the status file check
+            os.chmod(fifo_path, 0o666)
+            # Opening it for writing too keeps the FIFO from reporting EOF when the REST handler closes it
+            return os.open(fifo_path, os.O_RDWR | os.O_NONBLOCK)
+        except OSError as e:
+            self.debug_print(f"Unable to create the authorization FIFO, falling back to polling: {_get_error_message_from_exception(e, self)}")
+            return None
+
     def _wait(self, action_result):
         """This function is used to hold the action till user login.
 
@@ -827,17 +1461,44 @@ class MicrosoftTeamConnector(BaseConnector):
         app_dir = os.path.dirname(os.path.abspath(__file__))
         # file to check whether the request has been granted or not
         auth_status_file_path = f"{app_dir}/{self.get_asset_id()}_{MSTEAMS_TC_FILE}"
-        time_out = False
+        fifo_path = f"{app_dir}/{self.get_asset_id()}_{MSTEAMS_TC_FIFO}"
+        fifo_fd = self._open_auth_fifo(fifo_path)
+        deadline = time.monotonic() + MSTEAMS_TC_STATUS_WAIT_TIME
+        authorized = False
 
-        # wait-time while request is being granted
-        for i in range(0, 35):
-            if os.path.isfile(auth_status_file_path):
-                time_out = True
-                os.unlink(auth_status_file_path)
-                break
-            time.sleep(MSTEAMS_TC_STATUS_SLEEP)
+        try:
+            # The status file stays the source of truth; the FIFO only wakes us up as soon as it is written,
+            # and the bounded wait covers a REST handler that could not open the FIFO
+            while True:
+                if os.path.isfile(auth_status_file_path):
+                    authorized = True
+                    os.unlink(auth_status_file_path)
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+
+                timeout = min(remaining, MSTEAMS_TC_STATUS_SLEEP)
+                if fifo_fd is None:
+                    time.sleep(timeout)
+                    continue
 
-        if not time_out:
+                readable, _, _ = select.select([fifo_fd], [], [], timeout)
+                if readable:
+                    try:
+                        os.read(fifo_fd, 512)
+                    except BlockingIOError:
+                        pass
+        finally:
+            if fifo_fd is not None:
+                os.close(fifo_fd)
+                try:
+                    os.unlink(fifo_path)
+                except OSError:
+                    pass
+
+        if not authorized:
             return action_result.set_status(phantom.APP_ERROR, status_message="Timeout. Please try again later.")
         self.send_progress("Authenticated")
         return phantom.APP_SUCCESS
@@ -878,11 +1539,11 @@ class MicrosoftTeamConnector(BaseConnector):
         self.save_progress(f"{MSTEAMS_ADMIN_CONSENT_MSG}{url_to_show}")
         self.debug_print(f"{MSTEAMS_ADMIN_CONSENT_MSG}{url_to_show}")
 
-        time.sleep(MSTEAMS_AUTHORIZE_WAIT_TIME)
-
         # Wait till authorization is given or timeout occurred
         status = self._wait(action_result=action_result)
         if phantom.is_fail(status):
+            # The redirect may have gone to an outdated URL, so look it up again on the next run
+            self._state.pop(MSTEAMS_APP_REST_URL_STRING, None)
             return action_result.get_status()
 
         self._state = _load_app_state(self.get_asset_id(), self)
@@ -903,28 +1564,493 @@ class MicrosoftTeamConnector(BaseConnector):
 
         action_result = self.add_action_result(ActionResult(dict(param)))
 
-        endpoint = MSTEAMS_MSGRAPH_LIST_USERS_ENDPOINT
+        if param.get(MSTEAMS_JSON_DELTA, False):
+            return self._list_directory_changes(action_result, param, MSTEAMS_DELTA_USERS, MSTEAMS_MSGRAPH_USERS_DELTA_ENDPOINT)
+
+        ret_val, limit, page_size = self._get_pagination_params(action_result, param, MSTEAMS_MAX_PAGE_SIZE)
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
+
+        endpoint = self._add_query_params(MSTEAMS_MSGRAPH_LIST_USERS_ENDPOINT, {"$top": page_size, "$select": self._get_select_fields(param)})
+        bytes_received = self._bytes_received
+
+        for status, response in self._paginate(action_result, endpoint, limit):
+            if phantom.is_fail(status):
+                return action_result.get_status()
+
+            users = response.get("value", [])
+            self._update_user_index(users)
+            for user in users:
+                action_result.add_data(user)
+
+        summary = action_result.update_summary({})
+        summary["total_users"] = action_result.get_data_size()
+        summary["bytes_transferred"] = self._bytes_received - bytes_received
+
+        return action_result.set_status(phantom.APP_SUCCESS)
+
+    def _list_directory_changes(self, action_result, param, resource, delta_endpoint):
+        """This function is used to list the users or groups changed since the last delta run.
+
+        The @odata.deltaLink of the last page is kept in the asset state, so the next run only returns
+        the objects added, changed or removed since this one. Without a stored link, a full sync is done.
+
+        :param action_result: Object of ActionResult class
+        :param param: Dictionary of input parameters
+        :param resource: Name of the resource (users/groups)
+        :param delta_endpoint: REST endpoint of the delta query
+        :return: status success/failure
+        """
+
+        if param.get(MSTEAMS_JSON_LIMIT) or param.get(MSTEAMS_JSON_PAGE_SIZE):
+            return action_result.set_status(phantom.APP_ERROR, MSTEAMS_DELTA_PAGINATION_PARAMS_MSG)
+
+        fields = self._get_select_fields(param)
+        delta_links = self._state.setdefault(MSTEAMS_DELTA_LINKS_STRING, {})
+        stored_delta = delta_links.get(resource) or {}
+
+        # A delta link only returns the properties it was created with, so start over when the fields change
+        if stored_delta.get("link") and stored_delta.get("fields") == fields:
+            endpoint = stored_delta["link"]
+            full_sync = False
+        else:
+            endpoint = self._add_query_params(delta_endpoint, {"$select": fields})
+            full_sync = True
+
+        bytes_received = self._bytes_received
+        delta_link = None
+        removed = 0
+
+        for status, response in self._paginate(action_result, endpoint):
+            if phantom.is_fail(status):
+                # Graph returns 410 Gone once the delta link has expired
+                if not full_sync and self._last_status_code == 410 and not action_result.get_data_size():
+                    self.debug_print(f"Stored delta link for {resource} has expired, starting a full sync")
+                    delta_links.pop(resource, None)
+                    return self._list_directory_changes(action_result, param, resource, delta_endpoint)
+                return action_result.get_status()
+
+            items = response.get("value", [])
+            if resource == MSTEAMS_DELTA_USERS:
+                self._update_user_index(items)
+
+            for item in items:
+                if MSTEAMS_DELTA_REMOVED_STRING in item:
+                    removed += 1
+                action_result.add_data(item)
+
+            delta_link = response.get(MSTEAMS_DELTA_LINK_STRING) or delta_link
+
+        if delta_link:
+            delta_links[resource] = {"link": delta_link, "fields": fields}
+
+        summary = action_result.update_summary({})
+        summary[f"total_{resource}"] = action_result.get_data_size()
+        summary["total_removed"] = removed
+        summary["full_sync"] = full_sync
+        summary["bytes_transferred"] = self._bytes_received - bytes_received
+
+        return action_result.set_status(phantom.APP_SUCCESS)
+
+    def _add_query_params(self, endpoint, query) -> str:
+        """This function is used to append OData query parameters to an endpoint.
+
+        :param endpoint: REST endpoint
+        :param query: Dictionary of query parameters, parameters with empty values are skipped
+        :return: endpoint with the query parameters
+        """
+
+        query = {key: value for key, value in query.items() if value not in (None, "")}
+        if not query:
+            return endpoint
+
+        separator = "&" if "?" in endpoint else "?"
+        return f"{endpoint}{separator}{urllib.urlencode(query, safe=MSTEAMS_ODATA_SAFE_CHARS)}"
+
+    def _get_pagination_params(self, action_result, param, max_page_size=None) -> tuple[bool, Optional[int], Optional[int]]:
+        """This function is used to validate the limit and page_size parameters of a list action.
+
+        :param action_result: Object of ActionResult class
+        :param param: Dictionary of input parameters
+        :param max_page_size: Maximum $top supported by the endpoint, None if $top is not supported
+        :return: status phantom.APP_ERROR/phantom.APP_SUCCESS, limit, page size
+        """
+
+        ret_val, limit = self._validate_integer(action_result, param.get(MSTEAMS_JSON_LIMIT), MSTEAMS_JSON_LIMIT)
+        if phantom.is_fail(ret_val):
+            return action_result.get_status(), None, None
+
+        ret_val, page_size = self._validate_integer(action_result, param.get(MSTEAMS_JSON_PAGE_SIZE), MSTEAMS_JSON_PAGE_SIZE)
+        if phantom.is_fail(ret_val):
+            return action_result.get_status(), None, None
+
+        if not max_page_size:
+            return phantom.APP_SUCCESS, limit, None
+
+        if page_size and page_size > max_page_size:
+            return action_result.set_status(phantom.APP_ERROR, MSTEAMS_INVALID_PAGE_SIZE_MSG.format(max_page_size=max_page_size)), None, None
+
+        # Ask Graph for exactly the number of items needed when they fit in one page
+        if not page_size and limit:
+            page_size = min(limit, max_page_size)
+
+        return phantom.APP_SUCCESS, limit, page_size
+
+    def _get_select_fields(self, param) -> Optional[str]:
+        """This function is used to convert the comma-separated fields parameter to a $select value.
+
+        :param param: Dictionary of input parameters
+        :return: comma-separated list of fields or None to select the default fields
+        """
+
+        fields = [field.strip() for field in param.get(MSTEAMS_JSON_FIELDS, "").split(",") if field.strip()]
+        return ",".join(fields) or None
+
+    def _paginate(self, action_result, endpoint, limit=None):
+        """This generator is used to fetch the pages of a paginated endpoint, following @odata.nextLink.
+
+        Fetching stops as soon as limit items have been returned, or when the caller stops iterating.
+
+        :param action_result: Object of ActionResult class
+        :param endpoint: REST endpoint of the first page
+        :param limit: Maximum number of items to return, None for all the items
+        :return: yields status phantom.APP_ERROR/phantom.APP_SUCCESS, response of the page with the items trimmed to the limit
+        """
+
+        remaining = limit
 
         while True:
             # make rest call
             status, response = self._update_request(endpoint=endpoint, action_result=action_result)
 
             if phantom.is_fail(status):
-                return action_result.get_status()
+                yield RetVal(action_result.get_status(), None)
+                return
 
-            for user in response.get("value", []):
-                action_result.add_data(user)
+            if remaining is not None:
+                response["value"] = response.get("value", [])[:remaining]
+                remaining -= len(response["value"])
 
-            if not response.get(MSTEAMS_NEXT_LINK_STRING):
-                break
+            yield RetVal(phantom.APP_SUCCESS, response)
+
+            if remaining == 0 or not response.get(MSTEAMS_NEXT_LINK_STRING):
+                return
 
             endpoint = response[MSTEAMS_NEXT_LINK_STRING]
 
+    def _get_all_pages(self, action_result, endpoint, limit=None) -> RetVal[bool, Optional[list]]:
+        """This function is used to get the items of all the pages of a paginated endpoint.
+
+        :param action_result: Object of ActionResult class
+        :param endpoint: REST endpoint of the first page
+        :param limit: Maximum number of items to return, None for all the items
+        :return: status phantom.APP_ERROR/phantom.APP_SUCCESS, list of items
+        """
+
+        items = []
+
+        for status, response in self._paginate(action_result, endpoint, limit):
+            if phantom.is_fail(status):
+                return RetVal(action_result.get_status(), None)
+
+            items.extend(response.get("value", []))
+
+        return RetVal(phantom.APP_SUCCESS, items)
+
+    def _run_concurrently(self, function, items, max_workers) -> list:
+        """This function is used to call the given function for each item on a bounded pool of worker threads.
+
+        :param function: Function to call with each item
+        :param items: List of items
+        :param max_workers: Maximum number of worker threads
+        :return: List of return values in the same order as items
+        """
+
+        if not items:
+            return []
+
+        max_workers = min(max_workers, MSTEAMS_MAX_WORKERS, len(items))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(function, items))
+
+    def _get_team_channels(self, team, sub_response) -> dict:
+        """This function is used to get all the channels of a team from the batched first page, following the next pages in a worker thread.
+
+        :param team: Dictionary containing the team
+        :param sub_response: Dictionary containing the JSON batch sub-response of the first page
+        :return: Dictionary containing the team, status, channels and error message
+        """
+
+        status_code = sub_response.get("status")
+        if not status_code or not 200 <= status_code < 300:
+            return {"team": team, "status": phantom.APP_ERROR, "channels": [], "error": self._get_batch_error_message(sub_response)}
+
+        body = sub_response.get("body") or {}
+        channels = body.get("value", [])
+        next_link = body.get(MSTEAMS_NEXT_LINK_STRING)
+        if not next_link:
+            return {"team": team, "status": phantom.APP_SUCCESS, "channels": channels, "error": None}
+
+        # Each worker thread records its status in its own action result
+        team_action_result = ActionResult()
+        status, next_channels = self._get_all_pages(team_action_result, next_link)
+        if phantom.is_fail(status):
+            return {"team": team, "status": status, "channels": [], "error": team_action_result.get_message()}
+
+        return {"team": team, "status": phantom.APP_SUCCESS, "channels": channels + next_channels, "error": None}
+
+    def _handle_list_all_channels(self, param):
+        """This function is used to list the channels of all the teams in the tenant.
+
+        :param param: Dictionary of input parameters
+        :return: status success/failure
+        """
+
+        self.save_progress(f"In action handler for: {self.get_action_identifier()}")
+        action_result = self.add_action_result(ActionResult(dict(param)))
+
+        ret_val, max_workers = self._validate_integer(
+            action_result, param.get(MSTEAMS_JSON_MAX_WORKERS, MSTEAMS_DEFAULT_MAX_WORKERS), MSTEAMS_JSON_MAX_WORKERS
+        )
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
+
+        status, teams = self._get_all_pages(action_result, MSTEAMS_MSGRAPH_TEAMS_ENDPOINT)
+        if phantom.is_fail(status):
+            return action_result.get_status()
+
+        # The first page of channels of up to 20 teams is fetched in a single batch call
+        self.save_progress(f"Fetching channels of {len(teams)} team(s)")
+        requests_list = [{"url": MSTEAMS_MSGRAPH_LIST_CHANNELS_ENDPOINT.format(group_id=team.get("id"))} for team in teams]
+        sub_responses = self._make_batch_request(requests_list, max_workers)
+
+        # Only the teams with more than one page of channels need further calls
+        team_results = []
+        paged_teams = []
+        for team, sub_response in zip(teams, sub_responses):
+            if (sub_response.get("body") or {}).get(MSTEAMS_NEXT_LINK_STRING):
+                paged_teams.append((team, sub_response))
+            else:
+                team_results.append(self._get_team_channels(team, sub_response))
+        team_results.extend(self._run_concurrently(lambda team_page: self._get_team_channels(*team_page), paged_teams, max_workers))
+
+        errors = []
+        for team_result in team_results:
+            team = team_result["team"]
+            if phantom.is_fail(team_result["status"]):
+                errors.append({"team_id": team.get("id"), "team_name": team.get("displayName"), "error": team_result["error"]})
+                continue
+
+            for channel in team_result["channels"]:
+                channel["teamId"] = team.get("id")
+                channel["teamDisplayName"] = team.get("displayName")
+                action_result.add_data(channel)
+
         summary = action_result.update_summary({})
-        summary["total_users"] = action_result.get_data_size()
+        summary["total_teams"] = len(teams)
+        summary["total_channels"] = action_result.get_data_size()
+        summary["failed_teams"] = len(errors)
+        summary["errors"] = errors
 
         return action_result.set_status(phantom.APP_SUCCESS)
 
+    def _load_channel_cache(self) -> dict:
+        """This function is used to load the channel membership cache of the asset.
+
+        :return: Dictionary of group_id to cached channel IDs and the time they were fetched
+        """
+
+        if self._channel_cache is None:
+            self._channel_cache = _load_app_file(self.get_asset_id(), MSTEAMS_CHANNEL_CACHE_FILE, self)
+            if not isinstance(self._channel_cache, dict):
+                self._channel_cache = {}
+
+        return self._channel_cache
+
+    def _get_cached_channel_ids(self, group_id) -> Optional[list]:
+        """This function is used to get the cached channel IDs of a group.
+
+        :param group_id: ID of group
+        :return: List of channel IDs or None if the group is not cached or the entry has expired
+        """
+
+        if not self._channel_cache_ttl:
+            return None
+
+        entry = self._load_channel_cache().get(group_id)
+        if not isinstance(entry, dict) or time.time() - entry.get("updated_at", 0) > self._channel_cache_ttl:
+            return None
+
+        return entry.get("channel_ids")
+
+    def _update_channel_cache(self, group_id, channel_ids):
+        """This function is used to cache the channel IDs of a group, evicting the oldest groups above the size limit.
+
+        :param group_id: ID of group
+        :param channel_ids: List of channel IDs of the group
+        """
+
+        if not self._channel_cache_ttl:
+            return
+
+        channel_cache = self._load_channel_cache()
+        channel_cache[group_id] = {"channel_ids": channel_ids, "updated_at": int(time.time())}
+
+        if len(channel_cache) > MSTEAMS_CHANNEL_CACHE_MAX_GROUPS:
+            oldest_group_ids = sorted(channel_cache, key=lambda cached_group_id: channel_cache[cached_group_id].get("updated_at", 0))
+            for cached_group_id in oldest_group_ids[: len(channel_cache) - MSTEAMS_CHANNEL_CACHE_MAX_GROUPS]:
+                del channel_cache[cached_group_id]
+
+        self._channel_cache_dirty = True
+
+    def _invalidate_channel_cache(self, group_id):
+        """This function is used to drop the cached channel IDs of a group after Graph returned 404 for it.
+
+        :param group_id: ID of group
+        """
+
+        if self._last_status_code != 404:
+            return
+
+        if self._load_channel_cache().pop(group_id, None) is not None:
+            self.debug_print(f"Invalidated cached channels of group {group_id}")
+            self._channel_cache_dirty = True
+
+    def _save_channel_cache(self):
+        """This function is used to save the channel membership cache if it was changed during the run."""
+
+        if self._channel_cache_dirty:
+            _save_app_file(self._channel_cache, self.get_asset_id(), MSTEAMS_CHANNEL_CACHE_FILE, self)
+            self._channel_cache_dirty = False
+
+    def _load_user_index(self) -> dict:
+        """This function is used to load the local index of user email addresses, UPNs and display names.
+
+        :return: Dictionary containing the user index of the asset
+        """
+
+        if self._user_index is None:
+            self._user_index = _load_app_file(self.get_asset_id(), MSTEAMS_USER_INDEX_FILE, self)
+            if not isinstance(self._user_index, dict):
+                self._user_index = {}
+            self._user_index.setdefault("users", {})
+            self._user_index.setdefault("display_names", {})
+            self._user_index.setdefault("user_keys", {})
+
+        return self._user_index
+
+    def _update_user_index(self, users):
+        """This function is used to add the mail, UPN and display name of users to the user index.
+
+        Users removed in a delta query are dropped from the index, and the previous mail, UPN or display name
+        of a user is dropped when a new value is returned for it.
+
+        :param users: List of user dictionaries returned by Microsoft Graph
+        """
+
+        user_index = self._load_user_index()
+
+        for user in users:
+            user_id = user.get("id")
+            if not user_id:
+                continue
+
+            if MSTEAMS_DELTA_REMOVED_STRING in user:
+                self._remove_from_user_index(user_id)
+                continue
+
+            # Delta queries and $select only return some of the properties, so only the returned ones are replaced
+            user_keys = user_index["user_keys"].setdefault(user_id, {})
+            for field, mapping in MSTEAMS_USER_INDEX_KEY_FIELDS.items():
+                if field not in user:
+                    continue
+                new_key = (user[field] or "").lower() or None
+                old_key = user_keys.get(field)
+                if old_key == new_key:
+                    continue
+                user_keys[field] = new_key
+                self._user_index_dirty = True
+                # The mail and the UPN of a user are often the same key, which is kept while either still uses it
+                still_used = any(
+                    user_keys.get(other) == old_key for other, other_mapping in MSTEAMS_USER_INDEX_KEY_FIELDS.items() if other_mapping == mapping
+                )
+                if old_key and not still_used and user_index[mapping].get(old_key) == user_id:
+                    del user_index[mapping][old_key]
+
+            for key in (user.get("mail"), user.get("userPrincipalName")):
+                if key and user_index["users"].get(key.lower()) != user_id:
+                    user_index["users"][key.lower()] = user_id
+                    self._user_index_dirty = True
+
+            # Display names are not unique, so ambiguous names are kept without an ID
+            display_name = (user.get("displayName") or "").lower()
+            if display_name and display_name not in user_index["display_names"]:
+                user_index["display_names"][display_name] = user_id
+                self._user_index_dirty = True
+            elif display_name and user_index["display_names"][display_name] not in (user_id, None):
+                user_index["display_names"][display_name] = None
+                self._user_index_dirty = True
+
+    def _remove_from_user_index(self, user_id):
+        """This function is used to remove all the keys of a user from the user index.
+
+        :param user_id: ID of the user
+        """
+
+        user_index = self._load_user_index()
+        if user_index["user_keys"].pop(user_id, None) is not None:
+            self._user_index_dirty = True
+        for mapping in (user_index["users"], user_index["display_names"]):
+            for key in [key for key, indexed_id in mapping.items() if indexed_id == user_id]:
+                del mapping[key]
+                self._user_index_dirty = True
+
+    def _save_user_index(self):
+        """This function is used to save the user index if it was changed during the run."""
+
+        if self._user_index_dirty:
+            _save_app_file(self._user_index, self.get_asset_id(), MSTEAMS_USER_INDEX_FILE, self)
+            self._user_index_dirty = False
+
+    def _resolve_user_id(self, action_result, user) -> RetVal[bool, Optional[str]]:
+        """This function is used to resolve an email address, UPN or display name to the ID of the user.
+
+        The local user index is checked first and Microsoft Graph is only called on a miss.
+
+        :param action_result: Object of ActionResult class
+        :param user: ID, email address, UPN or display name of the user
+        :return: status phantom.APP_ERROR/phantom.APP_SUCCESS, ID of the user
+        """
+
+        user = user.strip()
+        if re.match(MSTEAMS_GUID_REGEX, user):
+            return RetVal(phantom.APP_SUCCESS, user)
+
+        user_index = self._load_user_index()
+        user_id = user_index["users"].get(user.lower()) or user_index["display_names"].get(user.lower())
+        if user_id:
+            return RetVal(phantom.APP_SUCCESS, user_id)
+
+        if "@" not in user:
+            return RetVal(action_result.set_status(phantom.APP_ERROR, MSTEAMS_USER_NOT_FOUND_MSG.format(user=user)), None)
+
+        select = {"$select": MSTEAMS_USER_INDEX_FIELDS}
+        endpoint = self._add_query_params(MSTEAMS_MSGRAPH_USER_ENDPOINT.format(user=urllib.quote(user)), select)
+        status, response = self._update_request(endpoint=endpoint, action_result=action_result)
+
+        if phantom.is_fail(status):
+            # An email address is not always the UPN of the user, so look it up by mail
+            escaped_user = user.replace("'", "''")
+            query = {"$filter": f"mail eq '{escaped_user}'", **select}
+            endpoint = self._add_query_params(MSTEAMS_MSGRAPH_LIST_USERS_ENDPOINT, query)
+            status, response = self._update_request(endpoint=endpoint, action_result=action_result)
+            if phantom.is_fail(status) or not response.get("value"):
+                return RetVal(action_result.set_status(phantom.APP_ERROR, MSTEAMS_USER_NOT_FOUND_MSG.format(user=user)), None)
+            response = response["value"][0]
+
+        self._update_user_index([response])
+        return RetVal(phantom.APP_SUCCESS, response.get("id"))
+
     def _verify_parameters(self, group_id, channel_id, action_result) -> bool:
         """This function is used to verify that the provided group_id is valid and channel_id belongs
         to that group_id.
@@ -935,33 +2061,101 @@ class MicrosoftTeamConnector(BaseConnector):
         :return: status (success/failed)
         """
 
-        endpoint = MSTEAMS_MSGRAPH_LIST_CHANNELS_ENDPOINT.format(group_id=group_id)
-        channel_list = []
-
-        while True:
-            # make rest call
-            status, response = self._update_request(endpoint=endpoint, action_result=action_result)
-
-            if phantom.is_fail(status):
-                return action_result.get_status()
+        cached_channel_ids = self._get_cached_channel_ids(group_id)
+        if cached_channel_ids and channel_id in cached_channel_ids:
+            return phantom.APP_SUCCESS
 
-            for channel in response.get("value", []):
-                channel_list.append(channel["id"])
+        endpoint = MSTEAMS_MSGRAPH_LIST_CHANNELS_ENDPOINT.format(group_id=group_id)
+        status, channels = self._get_all_pages(action_result, endpoint)
 
-            if not response.get(MSTEAMS_NEXT_LINK_STRING):
-                break
+        if phantom.is_fail(status):
+            self._invalidate_channel_cache(group_id)
+            return action_result.get_status()
 
-            endpoint = response[MSTEAMS_NEXT_LINK_STRING]
+        channel_list = [channel["id"] for channel in channels]
+        self._update_channel_cache(group_id, channel_list)
 
         if channel_id not in channel_list:
             return action_result.set_status(
                 phantom.APP_ERROR, status_message=MSTEAMS_INVALID_CHANNEL_MSG.format(channel_id=channel_id, group_id=group_id)
             )
 
-        return phantom.APP_SUCCESS
+        return phantom.APP_SUCCESS
+
+    def _handle_send_channel_message(self, param: dict) -> str:
+        """This function is used to Sends a message to a specified channel in a Microsoft Teams group.
+
+        :param param: Dictionary of input parameters
+        :return: status success/failure
+        """
+
+        self.save_progress(f"In action handler for: {self.get_action_identifier()}")
+        action_result = self.add_action_result(ActionResult(dict(param)))
+
+        group_id = param[MSTEAMS_JSON_GROUP_ID]
+        channel_id = param[MSTEAMS_JSON_CHANNEL_ID]
+        message = param[MSTEAMS_JSON_MSG]
+
+        status = self._verify_parameters(group_id=group_id, channel_id=channel_id, action_result=action_result)
+
+        if phantom.is_fail(status):
+            error_message = action_result.get_message()
+            if "teamId" in error_message:
+                error_message = error_message.replace("teamId", "'group_id'")
+            return action_result.set_status(phantom.APP_ERROR, error_message)
+
+        endpoint = MSTEAMS_MSGRAPH_SEND_CHANNEL_MSG_ENDPOINT.format(group_id=group_id, channel_id=channel_id)
+
+        data = {"body": {"contentType": "html", "content": message}}
+
+        # make rest call
+        status, response = self._update_request(endpoint=endpoint, action_result=action_result, method="post", data=json.dumps(data))
+
+        if phantom.is_fail(status):
+            self._invalidate_channel_cache(group_id)
+            error_message = action_result.get_message()
+            if "teamId" in error_message:
+                error_message = error_message.replace("teamId", "'group_id'")
+            return action_result.set_status(phantom.APP_ERROR, error_message)
+
+        action_result.add_data(response)
+
+        return action_result.set_status(phantom.APP_SUCCESS, status_message="Message sent")
+
+    def _get_channel_targets(self, action_result, channels) -> RetVal[bool, Optional[list]]:
+        """This function is used to parse a comma-separated list of group_id/channel_id channel targets.
+
+        :param action_result: Object of ActionResult class
+        :param channels: Comma-separated list of channels
+        :return: status phantom.APP_ERROR/phantom.APP_SUCCESS, list of unique (group_id, channel_id) tuples
+        """
+
+        targets = []
+        for channel in get_list_from_string(channels or ""):
+            group_id, _, channel_id = channel.partition("/")
+            if not group_id.strip() or not channel_id.strip():
+                return RetVal(action_result.set_status(phantom.APP_ERROR, MSTEAMS_INVALID_CHANNEL_TARGET_MSG.format(channel=channel)), None)
+            targets.append((group_id.strip(), channel_id.strip()))
+
+        return RetVal(phantom.APP_SUCCESS, list(dict.fromkeys(targets)))
+
+    def _get_target_request(self, target, message) -> dict:
+        """This function is used to build the batch request sending a message to a channel or chat target of a bulk send.
+
+        :param target: Dictionary containing the target
+        :param message: Message to be sent
+        :return: Dictionary containing the method, url and body of the request
+        """
+
+        if target["target_type"] == "channel":
+            endpoint = MSTEAMS_MSGRAPH_SEND_CHANNEL_MSG_ENDPOINT.format(group_id=target["group_id"], channel_id=target["channel_id"])
+        else:
+            endpoint = MSTEAMS_MSGRAPH_SEND_DIRECT_MSG_ENDPOINT.format(chat_id=target["chat_id"])
+
+        return {"method": "POST", "url": endpoint, "body": {"body": {"contentType": "html", "content": message}}}
 
-    def _handle_send_channel_message(self, param: dict) -> str:
-        """This function is used to Sends a message to a specified channel in a Microsoft Teams group.
+    def _handle_send_bulk_message(self, param):
+        """This function is used to send a message to multiple channels and chats through JSON batch calls.
 
         :param param: Dictionary of input parameters
         :return: status success/failure
@@ -970,34 +2164,89 @@ class MicrosoftTeamConnector(BaseConnector):
         self.save_progress(f"In action handler for: {self.get_action_identifier()}")
         action_result = self.add_action_result(ActionResult(dict(param)))
 
-        group_id = param[MSTEAMS_JSON_GROUP_ID]
-        channel_id = param[MSTEAMS_JSON_CHANNEL_ID]
         message = param[MSTEAMS_JSON_MSG]
 
-        status = self._verify_parameters(group_id=group_id, channel_id=channel_id, action_result=action_result)
+        ret_val, max_workers = self._validate_integer(
+            action_result, param.get(MSTEAMS_JSON_MAX_WORKERS, MSTEAMS_DEFAULT_MAX_WORKERS), MSTEAMS_JSON_MAX_WORKERS
+        )
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
 
-        if phantom.is_fail(status):
-            error_message = action_result.get_message()
-            if "teamId" in error_message:
-                error_message = error_message.replace("teamId", "'group_id'")
-            return action_result.set_status(phantom.APP_ERROR, error_message)
+        ret_val, channels = self._get_channel_targets(action_result, param.get(MSTEAMS_JSON_CHANNELS))
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
 
-        endpoint = MSTEAMS_MSGRAPH_SEND_CHANNEL_MSG_ENDPOINT.format(group_id=group_id, channel_id=channel_id)
+        targets = []
+        for group_id, channel_id in channels:
+            targets.append({"target_type": "channel", "group_id": group_id, "channel_id": channel_id, "chat_id": None})
 
-        data = {"body": {"contentType": "html", "content": message}}
+        for chat_id in dict.fromkeys(get_list_from_string(param.get(MSTEAMS_JSON_CHAT_IDS, ""))):
+            targets.append({"target_type": "chat", "group_id": None, "channel_id": None, "chat_id": chat_id})
 
-        # make rest call
-        status, response = self._update_request(endpoint=endpoint, action_result=action_result, method="post", data=json.dumps(data))
+        if not targets:
+            return action_result.set_status(phantom.APP_ERROR, MSTEAMS_NO_TARGETS_MSG)
 
-        if phantom.is_fail(status):
-            error_message = action_result.get_message()
-            if "teamId" in error_message:
-                error_message = error_message.replace("teamId", "'group_id'")
-            return action_result.set_status(phantom.APP_ERROR, error_message)
+        # Targets are not verified beforehand, Graph rejects the message of an invalid channel or chat
+        self.save_progress(f"Sending message to {len(targets)} target(s)")
+        sub_responses = self._make_batch_request([self._get_target_request(target, message) for target in targets], max_workers)
 
-        action_result.add_data(response)
+        for target, sub_response in zip(targets, sub_responses):
+            status_code = sub_response.get("status")
+            response = sub_response.get("body") or {}
+            if not status_code or not 200 <= status_code < 300:
+                target.update({"status": "failed", "message_id": None, "error": self._get_batch_error_message(sub_response)})
+            else:
+                target.update({"status": "success", "message_id": response.get("id"), "error": None})
+                # The state is only changed here in the main thread, once the batch calls are done
+                if target["target_type"] == "chat":
+                    self._record_message_timestamp(target["chat_id"], response)
+            action_result.add_data(target)
 
-        return action_result.set_status(phantom.APP_SUCCESS, status_message="Message sent")
+        failed = sum(1 for target_result in action_result.get_data() if target_result["status"] == "failed")
+        summary = action_result.update_summary({})
+        summary["total_targets"] = len(targets)
+        summary["successful_targets"] = len(targets) - failed
+        summary["failed_targets"] = failed
+
+        if failed == len(targets):
+            return action_result.set_status(phantom.APP_ERROR, MSTEAMS_BULK_SEND_FAILED_MSG.format(total=len(targets)))
+
+        return action_result.set_status(phantom.APP_SUCCESS)
+
+    def _get_bot_credentials(self):
+        """This function is used to get the Bot Framework app credentials, reusing the access token cached in the asset state.
+
+        :return: SOARAppCredentials object
+        """
+
+        from microsoftteams_webhook import SOARAppCredentials
+
+        bot_token = self._state.get(MSTEAMS_BOT_TOKEN_STRING, {})
+        if bot_token.get(MSTEAMS_APP_ID_STRING) != self._client_id:
+            bot_token = {}
+
+        return SOARAppCredentials(
+            self._client_id,
+            self._client_secret,
+            access_token=self._bot_access_token if bot_token else None,
+            expires_on=bot_token.get(MSTEAMS_EXPIRES_ON_STRING),
+            refresh_skew=self._token_refresh_skew,
+            on_token=self._save_bot_token,
+        )
+
+    def _save_bot_token(self, access_token, expires_on):
+        """This function is used to cache a new Bot Framework access token in the asset state, it is encrypted in finalize.
+
+        :param access_token: Bot Framework access token
+        :param expires_on: expiry time of the access token as a Unix timestamp
+        """
+
+        self._bot_access_token = access_token
+        self._state[MSTEAMS_BOT_TOKEN_STRING] = {
+            MSTEAMS_ACCESS_TOKEN_STRING: access_token,
+            MSTEAMS_EXPIRES_ON_STRING: expires_on,
+            MSTEAMS_APP_ID_STRING: self._client_id,
+        }
 
     def _handle_ask_question(self, param: dict) -> str:
         """This function is used to Sends a message to a specified channel in a Microsoft Teams group.
@@ -1011,53 +2260,107 @@ class MicrosoftTeamConnector(BaseConnector):
 
         group_id = param.get(MSTEAMS_JSON_GROUP_ID)
         channel_id = param.get(MSTEAMS_JSON_CHANNEL_ID)
-        user_id = param.get(MSTEAMS_JSON_USER_ID)
         message = param[MSTEAMS_JSON_MSG]
         choices = param.get(MSTEAMS_JSON_CHOICES, "")
 
         choices_split = get_list_from_string(choices)
 
-        card = create_question_card(message, choices_split)
-        bot = TeamsChannelAccount(id=self._client_id, name="SOARBot")
-        activity = Activity(type="message", attachments=[card])
+        ret_val, targets = self._get_channel_targets(action_result, param.get(MSTEAMS_JSON_CHANNELS))
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
 
-        status = self._verify_parameters(group_id=group_id, channel_id=channel_id, action_result=action_result)
+        if group_id or channel_id:
+            if not (group_id and channel_id):
+                return action_result.set_status(phantom.APP_ERROR, MSTEAMS_ASK_QUESTION_CHANNEL_MSG)
+            targets = [(group_id, channel_id)] + [target for target in targets if target != (group_id, channel_id)]
 
-        if phantom.is_fail(status):
-            error_message = action_result.get_message()
-            if "teamId" in error_message:
-                error_message = error_message.replace("teamId", "'group_id'")
-            return action_result.set_status(phantom.APP_ERROR, error_message)
+        if not targets:
+            return action_result.set_status(phantom.APP_ERROR, MSTEAMS_ASK_QUESTION_NO_TARGETS_MSG)
 
-        channel_data = TeamsChannelData(
-            channel=ChannelInfo(id=channel_id),
-            team=TeamInfo(id=group_id),
-            tenant=TenantInfo(id=self._tenant),
-        )
-        parameters = ConversationParameters(
-            channel_data=channel_data,
-            tenant_id=self._tenant,
-            bot=bot,
-            activity=activity,
-        )
-        reference = ConversationReference(channel_id=channel_id)
+        for target_group_id, target_channel_id in targets:
+            status = self._verify_parameters(group_id=target_group_id, channel_id=target_channel_id, action_result=action_result)
+
+            if phantom.is_fail(status):
+                error_message = action_result.get_message()
+                if "teamId" in error_message:
+                    error_message = error_message.replace("teamId", "'group_id'")
+                return action_result.set_status(phantom.APP_ERROR, error_message)
+
+        # The Bot Framework is imported here, so that the other actions do not pay for loading it
+        from botbuilder.core import BotFrameworkAdapter, BotFrameworkAdapterSettings, TurnContext
+        from botbuilder.schema import Activity, ConversationParameters, ConversationReference
+        from botbuilder.schema.teams import ChannelInfo, TeamInfo, TeamsChannelAccount, TeamsChannelData, TenantInfo
+
+        from microsoftteams_webhook import create_question_card, record_activity, run_coroutine
 
-        adapter = BotFrameworkAdapter(BotFrameworkAdapterSettings(app_id=self._client_id, app_password=self._client_secret))
+        # Every card carries the question ID the run is suspended on, so an answer to any of them finds the run
+        question_id = uuid.uuid4().hex
+        card = create_question_card(message, choices_split, question_id)
+        bot = TeamsChannelAccount(id=self._client_id, name="SOARBot")
+
+        adapter = BotFrameworkAdapter(
+            BotFrameworkAdapterSettings(app_id=self._client_id, app_password=self._client_secret, app_credentials=self._get_bot_credentials())
+        )
 
         async def handle_create_conversation(turn_context: TurnContext) -> Activity:
             return turn_context.activity
 
-        activity: Activity = asyncio.run(
-            adapter.create_conversation(
+        def create_conversation(target_group_id, target_channel_id):
+            channel_data = TeamsChannelData(
+                channel=ChannelInfo(id=target_channel_id),
+                team=TeamInfo(id=target_group_id),
+                tenant=TenantInfo(id=self._tenant),
+            )
+            parameters = ConversationParameters(
+                channel_data=channel_data,
+                tenant_id=self._tenant,
+                bot=bot,
+                activity=Activity(type="message", attachments=[card]),
+            )
+            reference = ConversationReference(channel_id=target_channel_id)
+
+            return adapter.create_conversation(
                 reference=reference,
                 conversation_parameters=parameters,
                 service_url="https://smba.trafficmanager.net/teams",
                 logic=handle_create_conversation,
             )
-        )
 
-        self.save_progress(f"Sent message to channel with activity ID: {activity.id}")
-        suspend_token = self.suspend_run(activity.id)
+        async def send_questions():
+            return await asyncio.gather(
+                *(asyncio.wait_for(create_conversation(*target), MSTEAMS_ASK_QUESTION_TIMEOUT) for target in targets), return_exceptions=True
+            )
+
+        # The cards are posted concurrently on one adapter, so they share its credentials and connector client
+        try:
+            sent_activities = run_coroutine(send_questions(), MSTEAMS_ASK_QUESTION_TIMEOUT + MSTEAMS_DEFAULT_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            return action_result.set_status(phantom.APP_ERROR, MSTEAMS_ASK_QUESTION_TIMEOUT_MSG)
+
+        activities = {}
+        for (target_group_id, target_channel_id), activity in zip(targets, sent_activities):
+            if isinstance(activity, asyncio.TimeoutError):
+                self.save_progress(
+                    f"Failed to send message to channel {target_channel_id} of group {target_group_id}: {MSTEAMS_ASK_QUESTION_TIMEOUT_MSG}"
+                )
+                continue
+            if isinstance(activity, Exception):
+                error_text = _get_error_message_from_exception(activity, self)
+                self.save_progress(f"Failed to send message to channel {target_channel_id} of group {target_group_id}: {error_text}")
+                continue
+            self.save_progress(f"Sent message to channel {target_channel_id} with activity ID: {activity.id}")
+            activities[activity.id] = activity.conversation.id if activity.conversation else None
+
+        if not activities:
+            return action_result.set_status(phantom.APP_ERROR, MSTEAMS_ASK_QUESTION_FAILED_MSG)
+
+        suspend_token = self.suspend_run(question_id)
+
+        # The index only saves the webhook a lookup of the suspended run, so the run is not failed when it cannot be written
+        try:
+            record_activity(self._client_id, question_id, activities, dict(param))
+        except Exception as e:
+            self.debug_print(f"Unable to index the question cards: {_get_error_message_from_exception(e, self)}")
         self.save_progress(f"Delegated action to webhook with token: {suspend_token}")
         return True
 
@@ -1073,12 +2376,14 @@ class MicrosoftTeamConnector(BaseConnector):
 
         group_id = param[MSTEAMS_JSON_GROUP_ID]
 
-        endpoint = MSTEAMS_MSGRAPH_LIST_CHANNELS_ENDPOINT.format(group_id=group_id)
+        # List channels does not support $top, so only the limit is applied
+        ret_val, limit, _ = self._get_pagination_params(action_result, param)
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
 
-        while True:
-            # make rest call
-            status, response = self._update_request(endpoint=endpoint, action_result=action_result)
+        endpoint = MSTEAMS_MSGRAPH_LIST_CHANNELS_ENDPOINT.format(group_id=group_id)
 
+        for status, response in self._paginate(action_result, endpoint, limit):
             if phantom.is_fail(status):
                 error_message = action_result.get_message()
                 if "teamId" in error_message:
@@ -1088,11 +2393,6 @@ class MicrosoftTeamConnector(BaseConnector):
             for channel in response.get("value", []):
                 action_result.add_data(channel)
 
-            if not response.get(MSTEAMS_NEXT_LINK_STRING):
-                break
-
-            endpoint = response[MSTEAMS_NEXT_LINK_STRING]
-
         summary = action_result.update_summary({})
         summary["total_channels"] = action_result.get_data_size()
 
@@ -1107,25 +2407,27 @@ class MicrosoftTeamConnector(BaseConnector):
 
         self.save_progress(f"In action handler for: {self.get_action_identifier()}")
         action_result = self.add_action_result(ActionResult(dict(param)))
-        endpoint = MSTEAMS_MSGRAPH_GROUPS_ENDPOINT
 
-        while True:
-            # make rest call using refresh token
-            status, response = self._update_request(endpoint=endpoint, action_result=action_result)
+        if param.get(MSTEAMS_JSON_DELTA, False):
+            return self._list_directory_changes(action_result, param, MSTEAMS_DELTA_GROUPS, MSTEAMS_MSGRAPH_GROUPS_DELTA_ENDPOINT)
+
+        ret_val, limit, page_size = self._get_pagination_params(action_result, param, MSTEAMS_MAX_PAGE_SIZE)
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
 
+        endpoint = self._add_query_params(MSTEAMS_MSGRAPH_GROUPS_ENDPOINT, {"$top": page_size, "$select": self._get_select_fields(param)})
+        bytes_received = self._bytes_received
+
+        for status, response in self._paginate(action_result, endpoint, limit):
             if phantom.is_fail(status):
                 return action_result.get_status()
 
             for group in response.get("value", []):
                 action_result.add_data(group)
 
-            if not response.get(MSTEAMS_NEXT_LINK_STRING):
-                break
-
-            endpoint = response[MSTEAMS_NEXT_LINK_STRING]
-
         summary = action_result.update_summary({})
         summary["total_groups"] = action_result.get_data_size()
+        summary["bytes_transferred"] = self._bytes_received - bytes_received
 
         return action_result.set_status(phantom.APP_SUCCESS)
 
@@ -1138,25 +2440,24 @@ class MicrosoftTeamConnector(BaseConnector):
 
         self.save_progress(f"In action handler for: {self.get_action_identifier()}")
         action_result = self.add_action_result(ActionResult(dict(param)))
-        endpoint = MSTEAMS_MSGRAPH_TEAMS_ENDPOINT
 
-        while True:
-            # make rest call using refresh token
-            status, response = self._update_request(endpoint=endpoint, action_result=action_result)
+        ret_val, limit, page_size = self._get_pagination_params(action_result, param, MSTEAMS_MAX_PAGE_SIZE)
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
+
+        endpoint = self._add_query_params(MSTEAMS_MSGRAPH_TEAMS_ENDPOINT, {"$top": page_size, "$select": self._get_select_fields(param)})
+        bytes_received = self._bytes_received
 
+        for status, response in self._paginate(action_result, endpoint, limit):
             if phantom.is_fail(status):
                 return action_result.get_status()
 
             for team in response.get("value", []):
                 action_result.add_data(team)
 
-            if not response.get(MSTEAMS_NEXT_LINK_STRING):
-                break
-
-            endpoint = response[MSTEAMS_NEXT_LINK_STRING]
-
         summary = action_result.update_summary({})
         summary["total_teams"] = action_result.get_data_size()
+        summary["bytes_transferred"] = self._bytes_received - bytes_received
 
         return action_result.set_status(phantom.APP_SUCCESS)
 
@@ -1237,6 +2538,7 @@ class MicrosoftTeamConnector(BaseConnector):
         ret_val, response = self._update_request(endpoint=endpoint, action_result=action_result, method="get")
 
         if phantom.is_fail(ret_val):
+            self._invalidate_channel_cache(group_id)
             error_message = action_result.get_message()
             if "teamId" in error_message:
                 error_message = error_message.replace("teamId", "'group_id'")
@@ -1271,6 +2573,64 @@ class MicrosoftTeamConnector(BaseConnector):
 
         return action_result.set_status(phantom.APP_SUCCESS, status_message="Message successfully retrieved")
 
+    def _record_message_timestamp(self, chat_id, message):
+        """This function is used to remember when a chat message was sent, the timestamps are saved once in finalize.
+
+        :param chat_id: ID of the chat
+        :param message: Dictionary containing the sent message
+        """
+
+        if message.get("id") and message.get("createdDateTime"):
+            self._message_timestamps[f"{chat_id}/{message['id']}"] = message["createdDateTime"]
+
+    def _save_message_timestamps(self):
+        """This function is used to add the message timestamps recorded during the run to the message timestamps file.
+
+        The file is kept apart from the asset state, so sending a message does not rewrite the state and its tokens.
+        It is reloaded under an exclusive lock, so concurrent runs on the same asset do not drop each other's timestamps,
+        and the oldest messages above the size limit are evicted.
+        """
+
+        if not self._message_timestamps:
+            return
+
+        asset_id = self.get_asset_id()
+        with _lock_app_file(asset_id, MSTEAMS_MESSAGE_TIMESTAMPS_FILE):
+            message_timestamps = _load_app_file(asset_id, MSTEAMS_MESSAGE_TIMESTAMPS_FILE, self)
+            if not isinstance(message_timestamps, dict):
+                message_timestamps = {}
+
+            message_timestamps.update(self._message_timestamps)
+            for key in list(message_timestamps)[: max(len(message_timestamps) - MSTEAMS_MESSAGE_TIMESTAMPS_MAX, 0)]:
+                del message_timestamps[key]
+
+            _save_app_file(message_timestamps, asset_id, MSTEAMS_MESSAGE_TIMESTAMPS_FILE, self)
+
+        self._message_timestamps = {}
+
+    def _get_message_timestamp(self, chat_id, message_id) -> Optional[str]:
+        """This function is used to get when a chat message was sent, from the message timestamps file or else from the message itself.
+
+        :param chat_id: ID of the chat
+        :param message_id: ID of the message
+        :return: creation time of the message, None if it cannot be retrieved
+        """
+
+        key = f"{chat_id}/{message_id}"
+        sent_time = self._message_timestamps.get(key) or _load_app_file(self.get_asset_id(), MSTEAMS_MESSAGE_TIMESTAMPS_FILE, self).get(key)
+        if sent_time:
+            return sent_time
+
+        endpoint = MSTEAMS_MSGRAPH_GET_CHAT_MSG_ENDPOINT.format(chat_id=chat_id, message_id=message_id)
+        ret_val, response = self._update_request(endpoint=endpoint, action_result=ActionResult(), method="get")
+
+        if phantom.is_fail(ret_val):
+            self.debug_print(f"Unable to get the creation time of {message_id} message")
+            return None
+
+        self._record_message_timestamp(chat_id, response)
+        return response.get("createdDateTime")
+
     def _handle_get_response(self, param: dict) -> str:
         """This function is used to get reply messages from chat.
 
@@ -1284,24 +2644,34 @@ class MicrosoftTeamConnector(BaseConnector):
         chat_id = param[MSTEAMS_JSON_CHAT_ID]
         message_id = param[MSTEAMS_JSON_MSG_ID]
 
-        endpoint = MSTEAMS_MSGRAPH_SEND_DIRECT_MSG_ENDPOINT.format(chat_id=chat_id)
+        max_pages = param.get(MSTEAMS_JSON_MAX_PAGES)
+        if max_pages is not None:
+            ret_val, max_pages = self._validate_integer(action_result, max_pages, MSTEAMS_JSON_MAX_PAGES)
+            if phantom.is_fail(ret_val):
+                return action_result.get_status()
 
-        endpoint += "?$orderby=createdDateTime+desc&$top=50"
+        sent_time = self._get_message_timestamp(chat_id, message_id)
 
-        all_replies = []
+        if sent_time:
+            # Replies are modified after the message was sent, so only those pages are fetched
+            query = {
+                "$orderby": "lastModifiedDateTime desc",
+                "$filter": f"lastModifiedDateTime gt {sent_time}",
+                "$top": MSTEAMS_MAX_CHATS_PAGE_SIZE,
+            }
+        else:
+            query = {"$orderby": "createdDateTime desc", "$top": MSTEAMS_MAX_CHATS_PAGE_SIZE}
 
-        while True:
-            # make rest call
-            ret_val, response = self._update_request(endpoint=endpoint, action_result=action_result, method="get")
+        endpoint = self._add_query_params(MSTEAMS_MSGRAPH_SEND_DIRECT_MSG_ENDPOINT.format(chat_id=chat_id), query)
 
+        all_replies = []
+
+        for page_number, (ret_val, response) in enumerate(self._paginate(action_result, endpoint), 1):
             if phantom.is_fail(ret_val):
                 return action_result.set_status(phantom.APP_ERROR, action_result.get_message())
 
             replies = response.get("value", [])
 
-            if not replies:
-                return action_result.set_status(phantom.APP_ERROR, action_result.get_message())
-
             message_list = []
 
             try:
@@ -1320,12 +2690,12 @@ class MicrosoftTeamConnector(BaseConnector):
             except Exception as exc:
                 return action_result.set_status(phantom.APP_ERROR, f"An error occurred: {exc}")
 
-            if message_id in message_list:
+            # Without the filter, messages are in creation order and the replies are all newer than the message
+            if not sent_time and message_id in message_list:
                 break
 
-            if response.get(MSTEAMS_NEXT_LINK_STRING):
-                endpoint = response.get(MSTEAMS_NEXT_LINK_STRING)
-            else:
+            if max_pages and page_number >= max_pages:
+                self.debug_print(f"Stopped looking for replies to {message_id} message after {max_pages} page(s)")
                 break
 
         if not all_replies:
@@ -1366,20 +2736,29 @@ class MicrosoftTeamConnector(BaseConnector):
         if chat_type_filter and chat_type_filter not in MSTEAMS_VALID_CHAT_TYPES:
             return action_result.set_status(phantom.APP_ERROR, "Invalid chat type filter")
 
-        endpoint = MSTEAMS_MSGRAPH_LIST_CHATS_ENDPOINT
+        ret_val, limit, page_size = self._get_pagination_params(action_result, param, MSTEAMS_MAX_CHATS_PAGE_SIZE)
+        if phantom.is_fail(ret_val):
+            return action_result.get_status()
 
-        while True:
-            # make rest call
-            status, response = self._update_request(endpoint=endpoint, action_result=action_result)
+        query = {"$top": page_size}
+        if chat_type_filter:
+            query["$filter"] = f"chatType eq '{chat_type_filter}'"
+
+        if user_filter:
+            # Members are only returned when expanded, and Graph cannot filter chats on member email or ID substrings,
+            # so pages may hold fewer matching chats than requested and full pages are fetched unless told otherwise
+            query["$expand"] = "members"
+            if not param.get(MSTEAMS_JSON_PAGE_SIZE):
+                query["$top"] = MSTEAMS_MAX_CHATS_PAGE_SIZE
+
+        endpoint = self._add_query_params(MSTEAMS_MSGRAPH_LIST_CHATS_ENDPOINT, query)
 
+        # The limit applies to the filtered chats, so stop paginating once enough chats matched
+        for status, response in self._paginate(action_result, endpoint):
             if phantom.is_fail(status):
                 return action_result.get_status()
 
             for chat in response.get("value", []):
-                # Filters
-                if chat_type_filter and chat_type_filter != chat.get("chatType", ""):
-                    continue
-
                 if user_filter:
                     user_match = False
                     for member in chat.get("members", []):
@@ -1392,12 +2771,12 @@ class MicrosoftTeamConnector(BaseConnector):
                         continue
 
                 action_result.add_data(chat)
+                if limit and action_result.get_data_size() >= limit:
+                    break
 
-            if not response.get(MSTEAMS_NEXT_LINK_STRING):
+            if limit and action_result.get_data_size() >= limit:
                 break
 
-            endpoint = response[MSTEAMS_NEXT_LINK_STRING]
-
         summary = action_result.update_summary({})
         summary["total_chats"] = action_result.get_data_size()
 
@@ -1421,6 +2800,8 @@ class MicrosoftTeamConnector(BaseConnector):
         if phantom.is_fail(status):
             return action_result.get_status(), None
 
+        self._record_message_timestamp(chat_id, response)
+
         return phantom.APP_SUCCESS, response
 
     def _handle_send_chat_message(self, param):
@@ -1446,69 +2827,131 @@ class MicrosoftTeamConnector(BaseConnector):
 
         return action_result.set_status(phantom.APP_SUCCESS, status_message="Message sent to chat successfully")
 
-    def _handle_send_direct_message(self, param):
-        """This function is used to send a direct message to a user.
+    def _get_current_user_id(self, action_result) -> RetVal[bool, Optional[str]]:
+        """This function is used to get the ID of the authorized user, cached in the asset state.
 
-        :param param: Dictionary of input parameters
-        :return: status success/failure
+        :param action_result: ActionResult object
+        :return: status success/failure, ID of the current user
         """
 
-        self.save_progress(f"In action handler for: {self.get_action_identifier()}")
-        action_result = self.add_action_result(ActionResult(dict(param)))
-
-        user_id = param[MSTEAMS_JSON_USER_ID]
-        message = param[MSTEAMS_JSON_MSG]
+        current_user_id = self._state.get(MSTEAMS_CURRENT_USER_ID_STRING)
+        if current_user_id:
+            return RetVal(phantom.APP_SUCCESS, current_user_id)
 
-        # Get our ID
         status, me_response = self._update_request(endpoint=MSTEAMS_MSGRAPH_LIST_ME_ENDPOINT, action_result=action_result)
 
         if phantom.is_fail(status):
-            return action_result.set_status(phantom.APP_ERROR, "Failed to retrieve current user information")
+            return RetVal(action_result.set_status(phantom.APP_ERROR, "Failed to retrieve current user information"), None)
 
         current_user_id = me_response.get("id")
         if not current_user_id:
-            return action_result.set_status(phantom.APP_ERROR, "Failed to retrieve current user ID")
+            return RetVal(action_result.set_status(phantom.APP_ERROR, "Failed to retrieve current user ID"), None)
 
-        # Get chats and find our 1:1 with user
-        status, response = self._update_request(endpoint=MSTEAMS_MSGRAPH_LIST_CHATS_ENDPOINT, action_result=action_result)
+        self._state[MSTEAMS_CURRENT_USER_ID_STRING] = current_user_id
+        return RetVal(phantom.APP_SUCCESS, current_user_id)
 
-        if phantom.is_fail(status):
-            return action_result.get_status()
+    def _cache_direct_chat(self, user_id, chat_id):
+        """This function is used to remember the one-on-one chat with a user, evicting the oldest chats above the size limit.
+
+        :param user_id: ID of the user
+        :param chat_id: ID of the one-on-one chat with the user
+        """
+
+        direct_chats = self._state.setdefault(MSTEAMS_DIRECT_CHATS_STRING, {})
+        direct_chats.pop(user_id, None)
+        direct_chats[user_id] = chat_id
+
+        for cached_user_id in list(direct_chats)[: max(len(direct_chats) - MSTEAMS_DIRECT_CHATS_MAX, 0)]:
+            del direct_chats[cached_user_id]
+
+    def _get_one_on_one_chat_id(self, action_result, user_id) -> RetVal[bool, Optional[str]]:
+        """This function is used to find the one-on-one chat with a user, creating it if none exists.
+
+        :param action_result: ActionResult object
+        :param user_id: ID of the user
+        :return: status success/failure, ID of the chat
+        """
+
+        # Only one-on-one chats are fetched, with their members, and paging stops at the first match
+        query = {"$filter": "chatType eq 'oneOnOne'", "$expand": "members", "$top": MSTEAMS_MAX_CHATS_PAGE_SIZE}
+        endpoint = self._add_query_params(MSTEAMS_MSGRAPH_LIST_CHATS_ENDPOINT, query)
+
+        for status, response in self._paginate(action_result, endpoint):
+            if phantom.is_fail(status):
+                return RetVal(action_result.get_status(), None)
 
-        chat_id = None
-        for chat in response.get("value", []):
-            if chat.get("chatType") == "oneOnOne":
+            for chat in response.get("value", []):
                 members = chat.get("members", [])
                 if len(members) == 2 and any(member.get("userId") == user_id for member in members):
-                    chat_id = chat.get("id")
-                    break
+                    return RetVal(phantom.APP_SUCCESS, chat.get("id"))
 
-        if not chat_id:
-            # Create new chat if none exists
-            create_chat_endpoint = "/chats"
-            create_chat_data = {
-                "chatType": "oneOnOne",
-                "members": [
-                    {
-                        "@odata.type": "#microsoft.graph.aadUserConversationMember",
-                        "roles": ["owner"],
-                        "user@odata.bind": f"https://graph.microsoft.com/v1.0/users('{current_user_id}')",
-                    },
-                    {
-                        "@odata.type": "#microsoft.graph.aadUserConversationMember",
-                        "roles": ["owner"],
-                        "user@odata.bind": f"https://graph.microsoft.com/v1.0/users('{user_id}')",
-                    },
-                ],
-            }
-            status, response = self._update_request(
-                endpoint=create_chat_endpoint, action_result=action_result, method="post", data=json.dumps(create_chat_data)
-            )
+        status, current_user_id = self._get_current_user_id(action_result)
+        if phantom.is_fail(status):
+            return RetVal(action_result.get_status(), None)
+
+        # Create new chat if none exists
+        create_chat_endpoint = "/chats"
+        create_chat_data = {
+            "chatType": "oneOnOne",
+            "members": [
+                {
+                    "@odata.type": "#microsoft.graph.aadUserConversationMember",
+                    "roles": ["owner"],
+                    "user@odata.bind": f"https://graph.microsoft.com/v1.0/users('{current_user_id}')",
+                },
+                {
+                    "@odata.type": "#microsoft.graph.aadUserConversationMember",
+                    "roles": ["owner"],
+                    "user@odata.bind": f"https://graph.microsoft.com/v1.0/users('{user_id}')",
+                },
+            ],
+        }
+        status, response = self._update_request(
+            endpoint=create_chat_endpoint, action_result=action_result, method="post", data=json.dumps(create_chat_data)
+        )
 
-            if phantom.is_fail(status):
+        if phantom.is_fail(status):
+            return RetVal(action_result.get_status(), None)
+
+        return RetVal(phantom.APP_SUCCESS, response.get("id"))
+
+    def _handle_send_direct_message(self, param):
+        """This function is used to send a direct message to a user.
+
+        :param param: Dictionary of input parameters
+        :return: status success/failure
+        """
+
+        self.save_progress(f"In action handler for: {self.get_action_identifier()}")
+        action_result = self.add_action_result(ActionResult(dict(param)))
+
+        message = param[MSTEAMS_JSON_MSG]
+
+        status, user_id = self._resolve_user_id(action_result, param[MSTEAMS_JSON_USER_ID])
+        if phantom.is_fail(status):
+            return action_result.get_status()
+
+        direct_chats = self._state.setdefault(MSTEAMS_DIRECT_CHATS_STRING, {})
+        chat_id = direct_chats.get(user_id)
+
+        if chat_id:
+            status, response = self._send_chat_message(action_result, chat_id, message)
+            if phantom.is_success(status):
+                action_result.add_data(response)
+                return action_result.set_status(phantom.APP_SUCCESS, status_message="Message sent to user successfully")
+
+            if self._last_status_code not in (403, 404):
                 return action_result.get_status()
 
-            chat_id = response.get("id")
+            # The cached chat is gone or no longer accessible, look it up again
+            self.debug_print(f"Cached chat {chat_id} for user {user_id} is no longer valid")
+            direct_chats.pop(user_id, None)
+
+        status, chat_id = self._get_one_on_one_chat_id(action_result, user_id)
+        if phantom.is_fail(status):
+            return action_result.get_status()
+
+        self._cache_direct_chat(user_id, chat_id)
 
         # Send chat message now
         status, response = self._send_chat_message(action_result, chat_id, message)
@@ -1520,6 +2963,59 @@ class MicrosoftTeamConnector(BaseConnector):
 
         return action_result.set_status(phantom.APP_SUCCESS, status_message="Message sent to user successfully")
 
+    def _handle_batch_request(self, param):
+        """This function is used to send multiple Microsoft Graph requests using JSON batching.
+
+        :param param: Dictionary of input parameters
+        :return: status success/failure
+        """
+
+        self.save_progress(f"In action handler for: {self.get_action_identifier()}")
+        action_result = self.add_action_result(ActionResult(dict(param)))
+
+        try:
+            requests_list = json.loads(param[MSTEAMS_JSON_REQUESTS])
+        except Exception as e:
+            error_text = _get_error_message_from_exception(e, self)
+            return action_result.set_status(phantom.APP_ERROR, f"{MSTEAMS_INVALID_BATCH_REQUESTS_MSG} {error_text}")
+
+        if not isinstance(requests_list, list) or not requests_list:
+            return action_result.set_status(phantom.APP_ERROR, MSTEAMS_INVALID_BATCH_REQUESTS_MSG)
+
+        for request in requests_list:
+            if not isinstance(request, dict) or not request.get("url"):
+                return action_result.set_status(phantom.APP_ERROR, MSTEAMS_INVALID_BATCH_REQUESTS_MSG)
+            if str(request.get("method", "GET")).upper() not in MSTEAMS_BATCH_VALID_METHODS:
+                return action_result.set_status(phantom.APP_ERROR, MSTEAMS_INVALID_BATCH_METHOD_MSG.format(method=request.get("method")))
+
+        sub_responses = self._make_batch_request(requests_list)
+
+        successful_requests = 0
+        for request, sub_response in zip(requests_list, sub_responses):
+            status_code = sub_response.get("status")
+            if status_code and 200 <= status_code < 300:
+                successful_requests += 1
+            action_result.add_data(
+                {
+                    "id": sub_response.get("id"),
+                    "method": request.get("method", "GET").upper(),
+                    "url": request["url"],
+                    "status": status_code,
+                    "headers": sub_response.get("headers", {}),
+                    "body": sub_response.get("body"),
+                }
+            )
+
+        summary = action_result.update_summary({})
+        summary["total_requests"] = len(requests_list)
+        summary["successful_requests"] = successful_requests
+        summary["failed_requests"] = len(requests_list) - successful_requests
+
+        if not successful_requests:
+            return action_result.set_status(phantom.APP_ERROR, MSTEAMS_BATCH_FAILED_MSG.format(total=len(requests_list)))
+
+        return action_result.set_status(phantom.APP_SUCCESS)
+
     def handle_action(self, param):
         """This function gets current action identifier and calls member function of its own to handle the action.
 
@@ -1546,15 +3042,27 @@ class MicrosoftTeamConnector(BaseConnector):
             "get_chat_message": self._handle_get_chat_message,
             "get_response": self._handle_get_response,
             "list_chats": self._handle_list_chats,
+            "batch_request": self._handle_batch_request,
+            "list_all_channels": self._handle_list_all_channels,
+            "send_bulk_message": self._handle_send_bulk_message,
         }
 
         action = self.get_action_identifier()
         action_execution_status = phantom.APP_SUCCESS
 
+        retry_wait_time = self._retry_wait_time
+        action_results_count = len(self.get_action_results())
+
         if action in action_mapping.keys():
             action_function = action_mapping[action]
             action_execution_status = action_function(param)
 
+        retry_wait_time = self._retry_wait_time - retry_wait_time
+        if retry_wait_time:
+            self.save_progress(MSTEAMS_RETRY_WAIT_MSG.format(wait=retry_wait_time))
+            for action_result in self.get_action_results()[action_results_count:]:
+                action_result.update_summary({MSTEAMS_RETRY_WAIT_STRING: round(retry_wait_time, 1)})
+
         return action_execution_status
 
     def initialize(self):
@@ -1570,6 +3078,7 @@ class MicrosoftTeamConnector(BaseConnector):
             self.debug_print("Resetting the state file with the default format")
             self._state = {"app_version": self.get_app_json().get("app_version")}
             return self.set_status(phantom.APP_ERROR, MSTEAMS_STATE_FILE_CORRUPT_ERROR)
+        self._take_state_snapshot()
 
         # Fetching the Python major version
         try:
@@ -1585,7 +3094,34 @@ class MicrosoftTeamConnector(BaseConnector):
         self._client_secret = config[MSTEAMS_CONFIG_CLIENT_SECRET]
         self._access_token = self._state.get(MSTEAMS_TOKEN_STRING, {}).get(MSTEAMS_ACCESS_TOKEN_STRING)
         self._refresh_token = self._state.get(MSTEAMS_TOKEN_STRING, {}).get(MSTEAMS_REFRESH_TOKEN_STRING)
+        self._token_expires_on = self._state.get(MSTEAMS_TOKEN_STRING, {}).get(MSTEAMS_EXPIRES_ON_STRING)
+        self._bot_access_token = self._state.get(MSTEAMS_BOT_TOKEN_STRING, {}).get(MSTEAMS_ACCESS_TOKEN_STRING)
         self._scope = config[MSTEAMS_CONFIG_SCOPE]
+
+        ret_val, self._token_refresh_skew = self._validate_integer(
+            self, config.get(MSTEAMS_CONFIG_TOKEN_REFRESH_SKEW, MSTEAMS_DEFAULT_TOKEN_REFRESH_SKEW), MSTEAMS_CONFIG_TOKEN_REFRESH_SKEW, True
+        )
+        if phantom.is_fail(ret_val):
+            return self.get_status()
+
+        ret_val, self._channel_cache_ttl = self._validate_integer(
+            self, config.get(MSTEAMS_CONFIG_CHANNEL_CACHE_TTL, MSTEAMS_DEFAULT_CHANNEL_CACHE_TTL), MSTEAMS_CONFIG_CHANNEL_CACHE_TTL, True
+        )
+        if phantom.is_fail(ret_val):
+            return self.get_status()
+
+        ret_val, self._max_retries = self._validate_integer(
+            self, config.get(MSTEAMS_CONFIG_MAX_RETRIES, MSTEAMS_DEFAULT_MAX_RETRIES), MSTEAMS_CONFIG_MAX_RETRIES, True
+        )
+        if phantom.is_fail(ret_val):
+            return self.get_status()
+
+        ret_val, self._retry_deadline = self._validate_integer(
+            self, config.get(MSTEAMS_CONFIG_RETRY_DEADLINE, MSTEAMS_DEFAULT_RETRY_DEADLINE), MSTEAMS_CONFIG_RETRY_DEADLINE, True
+        )
+        if phantom.is_fail(ret_val):
+            return self.get_status()
+
         if self._state.get(MSTEAMS_STATE_IS_ENCRYPTED):
             try:
                 if self._access_token:
@@ -1600,6 +3136,15 @@ class MicrosoftTeamConnector(BaseConnector):
             except Exception as e:
                 self.debug_print(f"{MSTEAMS_DECRYPTION_ERROR}: {_get_error_message_from_exception(e, self)}")
                 return self.set_status(phantom.APP_ERROR, MSTEAMS_DECRYPTION_ERROR)
+
+            try:
+                if self._bot_access_token:
+                    self._bot_access_token = self.decrypt_state(self._bot_access_token, "bot access")
+            except Exception as e:
+                # The bot token is only a cache, so a new one is requested instead
+                self.debug_print(f"{MSTEAMS_DECRYPTION_ERROR}: {_get_error_message_from_exception(e, self)}")
+                self._bot_access_token = None
+                self._state.pop(MSTEAMS_BOT_TOKEN_STRING, None)
         self._timezone = config.get(MSTEAMS_CONFIG_TIMEZONE)
         return phantom.APP_SUCCESS
 
@@ -1611,6 +3156,11 @@ class MicrosoftTeamConnector(BaseConnector):
 
         :return: status (success/failure)
         """
+        self._close_session()
+        self._save_channel_cache()
+        self._save_user_index()
+        self._save_message_timestamps()
+
         try:
             if self._state.get(MSTEAMS_TOKEN_STRING, {}).get(MSTEAMS_ACCESS_TOKEN_STRING):
                 self._state[MSTEAMS_TOKEN_STRING][MSTEAMS_ACCESS_TOKEN_STRING] = self.encrypt_state(self._access_token, "access")
@@ -1624,10 +3174,16 @@ class MicrosoftTeamConnector(BaseConnector):
         except Exception as e:
             self.debug_print(f"{MSTEAMS_ENCRYPTION_ERROR}: {_get_error_message_from_exception(e, self)}")
             return self.set_status(phantom.APP_ERROR, MSTEAMS_ENCRYPTION_ERROR)
+
+        try:
+            if self._state.get(MSTEAMS_BOT_TOKEN_STRING, {}).get(MSTEAMS_ACCESS_TOKEN_STRING):
+                self._state[MSTEAMS_BOT_TOKEN_STRING][MSTEAMS_ACCESS_TOKEN_STRING] = self.encrypt_state(self._bot_access_token, "bot access")
+        except Exception as e:
+            self.debug_print(f"{MSTEAMS_ENCRYPTION_ERROR}: {_get_error_message_from_exception(e, self)}")
+            return self.set_status(phantom.APP_ERROR, MSTEAMS_ENCRYPTION_ERROR)
         self._state[MSTEAMS_STATE_IS_ENCRYPTED] = True
         # Save the state, this data is saved across actions and app upgrades
-        self.save_state(self._state)
-        _save_app_state(self._state, self.get_asset_id(), self)
+        self._save_state()
         return phantom.APP_SUCCESS
 
 
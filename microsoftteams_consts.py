@@ -27,6 +27,9 @@ MSTEAMS_MSGRAPH_SELF_ENDPOINT = "/me"
 MSTEAMS_MSGRAPH_GROUPS_ENDPOINT = "/groups"
 MSTEAMS_MSGRAPH_TEAMS_ENDPOINT = "/groups?$filter=resourceProvisioningOptions/Any(x:x eq 'Team')"
 MSTEAMS_MSGRAPH_LIST_USERS_ENDPOINT = "/users"
+MSTEAMS_MSGRAPH_USER_ENDPOINT = "/users/{user}"
+MSTEAMS_MSGRAPH_USERS_DELTA_ENDPOINT = "/users/delta"
+MSTEAMS_MSGRAPH_GROUPS_DELTA_ENDPOINT = "/groups/delta"
 MSTEAMS_MSGRAPH_LIST_CHANNELS_ENDPOINT = "/teams/{group_id}/channels"
 MSTEAMS_MSGRAPH_SEND_CHANNEL_MSG_ENDPOINT = "/teams/{group_id}/channels/{channel_id}/messages"
 MSTEAMS_MSGRAPH_LIST_CHATS_ENDPOINT = "/me/chats"
@@ -37,9 +40,22 @@ MSTEAMS_MSGRAPH_GET_CHANNEL_MSG_ENDPOINT = "/teams/{group_id}/channels/{channel_
 MSTEAMS_MSGRAPH_GET_CHAT_MSG_ENDPOINT = "/chats/{chat_id}/messages/{message_id}"
 MSTEAMS_MSGRAPH_CALENDER_EVENT_ENDPOINT = "/me/calendar/events"
 MSTEAMS_MSGRAPH_ONLINE_MEETING_ENDPOINT = "/me/onlineMeetings"
+MSTEAMS_MSGRAPH_BATCH_ENDPOINT = "/$batch"
 MSTEAMS_TC_FILE = "oauth_task.out"
+MSTEAMS_TC_FIFO = "oauth_task.fifo"
+MSTEAMS_STATE_FILE = "state.json"
+MSTEAMS_CHANNEL_CACHE_FILE = "channel_cache.json"
+MSTEAMS_USER_INDEX_FILE = "user_index.json"
+MSTEAMS_USER_INDEX_FIELDS = "id,mail,userPrincipalName,displayName"
+# Mapping of the indexed user properties to the part of the user index they are kept in
+MSTEAMS_USER_INDEX_KEY_FIELDS = {"mail": "users", "userPrincipalName": "users", "displayName": "display_names"}
+MSTEAMS_ACTIVITY_INDEX_FILE = "activity_index.json"
+MSTEAMS_MESSAGE_TIMESTAMPS_FILE = "message_timestamps.json"
+MSTEAMS_ACTIVITY_INDEX_MAX = 1000
+# Seconds after which the claim of a webhook request that never finished answering a question is released
+MSTEAMS_ACTIVITY_CLAIM_TIMEOUT = 120
 MSTEAMS_TC_STATUS_SLEEP = 3
-MSTEAMS_AUTHORIZE_WAIT_TIME = 15
+MSTEAMS_TC_STATUS_WAIT_TIME = 120
 MSTEAMS_TOKEN_NOT_AVAILABLE_MSG = "Token not available. Please run test connectivity first."
 MSTEAMS_BASE_URL_NOT_FOUND_MSG = "Phantom Base URL not found in System Settings. Please specify this value in System Settings."
 MSTEAMS_TEST_CONNECTIVITY_FAILED_MSG = "Test connectivity failed"
@@ -65,6 +81,7 @@ MSTEAMS_INVALID_CHANNEL_MSG = "Channel {channel_id} does not belongs to group {g
 MSTEAMS_TOKEN_EXPIRED_MSG = "Current access token has expired. New one will be generated."
 MSTEAMS_TOKEN_EXPIRED_MARKER = "the token is expired."
 MSTEAMS_TOKEN_GENERATED_MSG = "New access token successfully generated."
+MSTEAMS_TOKEN_EXPIRING_MSG = "Current access token is about to expire. New one will be generated."
 MSTEAMS_STATE_FILE_CORRUPT_ERROR = (
     "Error occurred while loading the state file due to it's unexpected format. "
     "Resetting the state file with the default format. Please test the connectivity."
@@ -87,6 +104,15 @@ MSTEAMS_JSON_DESCRIPTION = "description"
 MSTEAMS_JSON_START_TIME = "start_time"
 MSTEAMS_JSON_END_TIME = "end_time"
 MSTEAMS_JSON_ATTENDEES = "attendees"
+MSTEAMS_JSON_REQUESTS = "requests"
+MSTEAMS_JSON_MAX_WORKERS = "max_workers"
+MSTEAMS_JSON_LIMIT = "limit"
+MSTEAMS_JSON_PAGE_SIZE = "page_size"
+MSTEAMS_JSON_FIELDS = "fields"
+MSTEAMS_JSON_DELTA = "delta"
+MSTEAMS_JSON_CHANNELS = "channels"
+MSTEAMS_JSON_CHAT_IDS = "chat_ids"
+MSTEAMS_JSON_MAX_PAGES = "max_pages"
 MSTEAMS_CONFIG_TENANT_ID = "tenant_id"
 MSTEAMS_CONFIG_CLIENT_ID = "client_id"
 MSTEAMS_TOKEN_STRING = "token"
@@ -97,16 +123,99 @@ MSTEAMS_OAUTH_CONFIG_HASH = "oauth_config_hash"
 MSTEAMS_CONFIG_CLIENT_SECRET = "client_secret"  # pragma: allowlist secret
 MSTEAMS_CONFIG_TIMEZONE = "timezone"
 MSTEAMS_CONFIG_SCOPE = "scope"
+MSTEAMS_CONFIG_TOKEN_REFRESH_SKEW = "token_refresh_skew"
+MSTEAMS_DEFAULT_TOKEN_REFRESH_SKEW = 300
+MSTEAMS_CONFIG_CHANNEL_CACHE_TTL = "channel_cache_ttl"
+MSTEAMS_DEFAULT_CHANNEL_CACHE_TTL = 3600
+MSTEAMS_CHANNEL_CACHE_MAX_GROUPS = 500
+MSTEAMS_CONFIG_MAX_RETRIES = "max_retries"
+MSTEAMS_DEFAULT_MAX_RETRIES = 5
+MSTEAMS_CONFIG_RETRY_DEADLINE = "retry_deadline"
+MSTEAMS_DEFAULT_RETRY_DEADLINE = 120
+MSTEAMS_EXPIRES_IN_STRING = "expires_in"
+MSTEAMS_EXPIRES_ON_STRING = "expires_on"
+MSTEAMS_BOT_TOKEN_STRING = "bot_token"
+MSTEAMS_APP_ID_STRING = "app_id"
 MSTEAMS_NEXT_LINK_STRING = "@odata.nextLink"
+MSTEAMS_DELTA_LINK_STRING = "@odata.deltaLink"
+MSTEAMS_DELTA_REMOVED_STRING = "@removed"
+MSTEAMS_DELTA_LINKS_STRING = "delta_links"
+MSTEAMS_CURRENT_USER_ID_STRING = "current_user_id"
+MSTEAMS_DIRECT_CHATS_STRING = "direct_chats"
+MSTEAMS_DIRECT_CHATS_MAX = 1000
+MSTEAMS_MESSAGE_TIMESTAMPS_MAX = 1000
+MSTEAMS_APP_REST_URL_STRING = "app_rest_url"
+MSTEAMS_ASSET_ID_STRING = "asset_id"
+MSTEAMS_ASSET_NAME_STRING = "asset_name"
+MSTEAMS_BASE_URL_STRING = "base_url"
+MSTEAMS_URL_STRING = "url"
+MSTEAMS_DELTA_USERS = "users"
+MSTEAMS_DELTA_GROUPS = "groups"
+MSTEAMS_DELTA_PAGINATION_PARAMS_MSG = "The 'limit' and 'page_size' parameters cannot be used with the 'delta' parameter"
+MSTEAMS_ODATA_SAFE_CHARS = "$,'()/:"
+MSTEAMS_MAX_PAGE_SIZE = 999
+MSTEAMS_MAX_CHATS_PAGE_SIZE = 50
+MSTEAMS_INVALID_PAGE_SIZE_MSG = "Please provide a value less than or equal to {max_page_size} in the 'page_size' parameter"
 MSTEAMS_DEFAULT_TIMEOUT = 30
+# Teams gives up on a webhook request after 15 seconds
+MSTEAMS_WEBHOOK_TIMEOUT = 15
+MSTEAMS_ASK_QUESTION_TIMEOUT = 60
+MSTEAMS_HTTP_POOL_CONNECTIONS = 4
+MSTEAMS_HTTP_POOL_MAXSIZE = 16
+MSTEAMS_DEFAULT_MAX_WORKERS = 8
+MSTEAMS_MAX_WORKERS = MSTEAMS_HTTP_POOL_MAXSIZE
+MSTEAMS_RETRY_BACKOFF_BASE = 1
+MSTEAMS_RETRY_BACKOFF_MAX = 30
+MSTEAMS_MAX_RETRY_AFTER = 60
+# Graph rejects throttled and unavailable requests before processing them, so they are safe to retry for every method
+MSTEAMS_THROTTLE_STATUS_CODES = [429, 503]
+MSTEAMS_RETRY_STATUS_CODES = [500, 502, 504]
+MSTEAMS_IDEMPOTENT_METHODS = ["get", "put", "delete"]
+MSTEAMS_RETRY_MSG = "Request to {url} failed ({reason}), retrying in {wait:.1f} second(s)"
+MSTEAMS_RETRY_WAIT_MSG = "Waited {wait:.1f} second(s) on throttled or failed requests"
+MSTEAMS_RETRY_WAIT_STRING = "retry_wait_seconds"
+MSTEAMS_HTTP_SESSION_STATS_MSG = (
+    "HTTP session stats: {requests} request(s) sent over {connections} connection(s), {reused_connections} connection reuse(s)"
+)
 
+MSTEAMS_INVALID_CHANNEL_TARGET_MSG = "Invalid channel '{channel}' in the 'channels' parameter. Please provide channels as 'group_id/channel_id'"
+MSTEAMS_ASK_QUESTION_CHANNEL_MSG = "Please provide both 'group_id' and 'channel_id' parameters"
+MSTEAMS_ASK_QUESTION_NO_TARGETS_MSG = "Please provide the 'group_id' and 'channel_id' parameters or the 'channels' parameter"
+MSTEAMS_ASK_QUESTION_FAILED_MSG = "Failed to send the question to any channel"
+MSTEAMS_ASK_QUESTION_ANSWERED_MSG = "This question has already been answered"
+MSTEAMS_ASK_QUESTION_PENDING_MSG = "This question is already being answered"
+MSTEAMS_ASK_QUESTION_ERROR_MSG = "Unable to record the answer. Please try again"
+MSTEAMS_ASK_QUESTION_TIMEOUT_MSG = "Timed out sending the question"
+MSTEAMS_NO_TARGETS_MSG = "Please provide at least one target in the 'channels' or 'chat_ids' parameter"
+MSTEAMS_BULK_SEND_FAILED_MSG = "Failed to send the message to all {total} target(s)"
+MSTEAMS_GUID_REGEX = r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$"
+MSTEAMS_USER_NOT_FOUND_MSG = "Unable to find the user '{user}'. Please provide a valid user ID, email address or UPN"
 MSTEAMS_VALID_CHAT_TYPES = ["oneOnOne", "group", "meeting", "unknownFutureValue"]
 
+# For JSON batching
+MSTEAMS_BATCH_MAX_REQUESTS = 20
+MSTEAMS_BATCH_MAX_RETRIES = 3
+MSTEAMS_BATCH_RETRY_STATUS_CODES = [429, 503, 504]
+MSTEAMS_BATCH_SPLIT_STATUS_CODES = [400, 404, 413]
+MSTEAMS_BATCH_DEFAULT_RETRY_AFTER = 2
+MSTEAMS_BATCH_MAX_RETRY_AFTER = 60
+MSTEAMS_BATCH_VALID_METHODS = ["GET", "POST", "PUT", "PATCH", "DELETE"]
+MSTEAMS_INVALID_BATCH_REQUESTS_MSG = (
+    "Please provide a valid JSON list of requests in the 'requests' parameter. Each request must contain a relative 'url'."
+)
+MSTEAMS_INVALID_BATCH_METHOD_MSG = "Invalid method '{method}' in the 'requests' parameter"
+MSTEAMS_BATCH_FAILED_MSG = "All {total} request(s) in the batch failed"
+
 # For encryption and decryption
 MSTEAMS_ENCRYPT_TOKEN = "Encrypting the {} token"
 MSTEAMS_DECRYPT_TOKEN = "Decrypting the {} token"
 MSTEAMS_ENCRYPTION_ERROR = "Error occurred while encrypting the state file"
 MSTEAMS_DECRYPTION_ERROR = "Error occurred while decrypting the state file"
 
+# Constants relating to '_validate_integer'
+MSTEAMS_VALID_INT_MSG = "Please provide a valid integer value in the '{param}' parameter"
+MSTEAMS_NON_NEG_NON_ZERO_INT_MSG = "Please provide a valid non-zero positive integer value in the '{param}' parameter"
+MSTEAMS_NON_NEG_INT_MSG = "Please provide a valid non-negative integer value in the '{param}' parameter"
+
 # Constants relating to '_get_error_message_from_exception'
 ERROR_MSG_UNAVAILABLE = "Error message unavailable. Please check the asset configuration and|or action parameters"
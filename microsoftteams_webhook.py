@@ -12,21 +12,41 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 import asyncio
+import base64
+import concurrent.futures
+import hashlib
 import json
+import os
+import threading
+import time
+import uuid
+from collections.abc import Coroutine
 from io import BytesIO
 from pathlib import Path
-from typing import Union
+from typing import Any, Optional, Union
 from zipfile import ZipFile
 
 import phantom.app as phantom
 from botbuilder.core import ActivityHandler, Bot, BotFrameworkAdapterSettings, CardFactory, TurnContext
 from botbuilder.core.streaming import BotFrameworkHttpAdapterBase
-from botbuilder.schema import Activity, Attachment
+from botbuilder.schema import Activity, Attachment, ConversationAccount
+from botframework.connector.auth import MicrosoftAppCredentials
 from phantom.app import ActionResult
 from phantom.connector_result import ConnectorResult
 from phantom.utils import get_list_from_string
 
-from microsoftteams_consts import MSTEAMS_JSON_CHOICES, MSTEAMS_JSON_MSG
+from microsoftteams_connector import _load_app_file, _lock_app_file, _save_app_file
+from microsoftteams_consts import (
+    MSTEAMS_ACTIVITY_CLAIM_TIMEOUT,
+    MSTEAMS_ACTIVITY_INDEX_FILE,
+    MSTEAMS_ACTIVITY_INDEX_MAX,
+    MSTEAMS_ASK_QUESTION_ANSWERED_MSG,
+    MSTEAMS_ASK_QUESTION_ERROR_MSG,
+    MSTEAMS_ASK_QUESTION_PENDING_MSG,
+    MSTEAMS_JSON_CHOICES,
+    MSTEAMS_JSON_MSG,
+    MSTEAMS_WEBHOOK_TIMEOUT,
+)
 
 
 class SOARWebhookAdapter(BotFrameworkHttpAdapterBase):
@@ -51,7 +71,85 @@ class SOARWebhookAdapter(BotFrameworkHttpAdapterBase):
         return {"status_code": 201, "headers": {}, "content": ""}
 
 
-def create_question_card(question: str, choices: list[str]) -> Attachment:
+# Expiry of a JWT access token as a Unix timestamp, read without verifying the token
+def _get_jwt_expiry(token: str) -> Optional[int]:
+    try:
+        payload = token.split(".")[1]
+        return json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))).get("exp")
+    except Exception:
+        return None
+
+
+# Bot Framework app credentials that reuse a cached access token until shortly before it expires
+class SOARAppCredentials(MicrosoftAppCredentials):
+    def __init__(self, app_id, password, access_token=None, expires_on=None, refresh_skew=0, on_token=None):
+        super().__init__(app_id, password)
+        self.access_token = access_token
+        self.expires_on = expires_on
+        self.refresh_skew = refresh_skew
+        self.on_token = on_token
+
+    def get_access_token(self, force_refresh=False):
+        if not force_refresh and self.access_token and self.expires_on and time.time() + self.refresh_skew < self.expires_on:
+            return self.access_token
+
+        access_token = super().get_access_token(force_refresh)
+        self.access_token = access_token
+        self.expires_on = _get_jwt_expiry(access_token)
+        if self.on_token:
+            self.on_token(access_token, self.expires_on)
+
+        return access_token
+
+
+# One long-lived event loop on a background thread, so connector sessions and pools survive across activities
+_event_loop: Optional[asyncio.AbstractEventLoop] = None
+_event_loop_pid: Optional[int] = None
+_event_loop_lock = threading.Lock()
+
+
+def _get_event_loop() -> asyncio.AbstractEventLoop:
+    global _event_loop, _event_loop_pid
+    with _event_loop_lock:
+        # The loop thread does not survive a fork, so a forked process starts its own loop
+        if _event_loop is None or _event_loop.is_closed() or _event_loop_pid != os.getpid():
+            _event_loop = asyncio.new_event_loop()
+            _event_loop_pid = os.getpid()
+            threading.Thread(target=_event_loop.run_forever, name="msteams-event-loop", daemon=True).start()
+
+    return _event_loop
+
+
+def run_coroutine(coroutine: Coroutine[Any, Any, Any], timeout: Optional[float] = None) -> Any:
+    future = asyncio.run_coroutine_threadsafe(coroutine, _get_event_loop())
+    try:
+        return future.result(timeout)
+    except concurrent.futures.TimeoutError:
+        # Do not leave a stuck call running on the shared loop
+        future.cancel()
+        raise
+
+
+# Adapters by client ID and client secret hash, so the app credentials and connector clients they cache survive across requests
+_adapter_cache: dict[tuple[str, str], SOARWebhookAdapter] = {}
+_adapter_cache_lock = threading.Lock()
+
+
+def get_webhook_adapter(client_id: str, client_secret: str) -> SOARWebhookAdapter:
+    key = (client_id, hashlib.sha256((client_secret or "").encode()).hexdigest())
+    with _adapter_cache_lock:
+        adapter = _adapter_cache.get(key)
+        if adapter is None:
+            # Drop the adapters of a rotated client secret
+            for cached_key in [cached_key for cached_key in _adapter_cache if cached_key[0] == client_id]:
+                del _adapter_cache[cached_key]
+            adapter = SOARWebhookAdapter(BotFrameworkAdapterSettings(client_id, app_password=client_secret))
+            _adapter_cache[key] = adapter
+
+    return adapter
+
+
+def create_question_card(question: str, choices: list[str], question_id: Optional[str] = None) -> Attachment:
     if choices:
         form = {
             "type": "Input.ChoiceSet",
@@ -87,7 +185,7 @@ def create_question_card(question: str, choices: list[str]) -> Attachment:
                 form,
                 {
                     "type": "ActionSet",
-                    "actions": [{"type": "Action.Submit", "title": "Submit"}],
+                    "actions": [{"type": "Action.Submit", "title": "Submit", "data": {"question_id": question_id} if question_id else {}}],
                 },
             ],
         }
@@ -141,10 +239,160 @@ def create_completed_question_card(question: str, choices: list[str], answer: st
     )
 
 
+# Questions sent by the ask question action by activity ID, so answers can be handled without looking up the suspended run.
+# The webhook does not know the asset ID, so the index file is named after a hash of the client ID.
+def _get_activity_index_key(client_id: str) -> str:
+    return hashlib.sha256((client_id or "").encode()).hexdigest()[:32]
+
+
+def _load_activity_index(client_id: str) -> dict:
+    activity_index = _load_app_file(_get_activity_index_key(client_id), MSTEAMS_ACTIVITY_INDEX_FILE)
+    return activity_index if isinstance(activity_index, dict) else {}
+
+
+# All the cards of one question resolve the run, which is suspended on the question ID.
+# The connector and concurrent webhook requests update the index, so each update holds the file lock.
+def record_activity(client_id: str, question_id: str, activities: dict[str, Optional[str]], param: dict):
+    index_key = _get_activity_index_key(client_id)
+    with _lock_app_file(index_key, MSTEAMS_ACTIVITY_INDEX_FILE):
+        activity_index = _load_activity_index(client_id)
+        for activity_id in activities:
+            activity_index[activity_id] = {"question_id": question_id, "parameter": param, "activities": activities}
+
+        for cached_activity_id in list(activity_index)[: max(len(activity_index) - MSTEAMS_ACTIVITY_INDEX_MAX, 0)]:
+            activity_index.pop(cached_activity_id, None)
+
+        _save_app_file(activity_index, index_key, MSTEAMS_ACTIVITY_INDEX_FILE)
+
+
+# Applies an update to copies of the entries of all the cards of the question of an activity, under the file lock.
+# The update returns whether it changed the entry, and the entry of the activity is returned as it was before the update.
+def _update_question_activities(client_id: str, activity_id: str, update) -> Optional[dict]:
+    index_key = _get_activity_index_key(client_id)
+    with _lock_app_file(index_key, MSTEAMS_ACTIVITY_INDEX_FILE):
+        activity_index = _load_activity_index(client_id)
+        activity = activity_index.get(activity_id)
+        if activity is None or not update(dict(activity)):
+            return activity
+
+        for related_activity_id in activity.get("activities") or [activity_id]:
+            if related_activity_id in activity_index:
+                related_activity = dict(activity_index[related_activity_id])
+                if update(related_activity):
+                    activity_index[related_activity_id] = related_activity
+        _save_app_file(activity_index, index_key, MSTEAMS_ACTIVITY_INDEX_FILE)
+
+    return activity
+
+
+# Claims the question of an activity on all its cards while its run is finished, so concurrent answers do not finish it twice.
+# Returns the entry of the activity and whether it was claimed. It is not claimed when it is unknown, answered, or claimed
+# by another request less than MSTEAMS_ACTIVITY_CLAIM_TIMEOUT seconds ago.
+def claim_activity(client_id: str, activity_id: str, claim_id: str) -> tuple[Optional[dict], bool]:
+    now = time.time()
+
+    def can_claim(activity: dict) -> bool:
+        claimed_at = (activity.get("claim") or {}).get("claimed_at", 0)
+        return "answer" not in activity and now - claimed_at >= MSTEAMS_ACTIVITY_CLAIM_TIMEOUT
+
+    def claim(activity: dict) -> bool:
+        if not can_claim(activity):
+            return False
+        activity["claim"] = {"id": claim_id, "claimed_at": now}
+        return True
+
+    activity = _update_question_activities(client_id, activity_id, claim)
+    return activity, activity is not None and can_claim(activity)
+
+
+# Records the answer on all the cards once the run is finished. Answered questions stay in the index,
+# so a later answer on another card can be shown the first one.
+def answer_activity(client_id: str, activity_id: str, answer: str, answered_by: str):
+    def record(activity: dict) -> bool:
+        activity.pop("claim", None)
+        activity.update({"answer": answer, "answered_by": answered_by})
+        return True
+
+    _update_question_activities(client_id, activity_id, record)
+
+
+# Releases the claim on the question when its run could not be finished, so it can be answered again
+def release_activity(client_id: str, activity_id: str, claim_id: str):
+    def release(activity: dict) -> bool:
+        if (activity.get("claim") or {}).get("id") != claim_id:
+            return False
+        activity.pop("claim")
+        return True
+
+    _update_question_activities(client_id, activity_id, release)
+
+
 class SOARBot(ActivityHandler):
-    def __init__(self, soar_rest_client):
+    def __init__(self, soar_rest_client, client_id: Optional[str] = None):
         super(ActivityHandler, self).__init__()
         self.soar_rest_client = soar_rest_client
+        self.client_id = client_id
+
+    # Returns None when the question has no suspended run, because it was answered already or is unknown
+    def _get_question_result(self, question_id: str, activity: Optional[dict]) -> Optional[tuple[dict, ConnectorResult]]:
+        if activity is not None:
+            param = activity.get("parameter", {})
+            try:
+                return param, ConnectorResult.from_dict({"parameter": param})
+            except Exception:
+                pass
+
+        app_run = self.soar_rest_client.get_related_connector_run(question_id)
+        if not (isinstance(intermediate_results := app_run.get("result_data"), list) and intermediate_results):
+            return None
+
+        if not (isinstance(first_result := intermediate_results[0], dict)):
+            raise ValueError(f"Could not get intermediate connector run results for question {question_id}")
+
+        return first_result.get("parameter", {}), ConnectorResult.from_dict(first_result)
+
+    # Finishes the suspended run in a worker thread and records the outcome in the index itself, so that a webhook request
+    # cancelled on timeout neither leaves the question claimed nor marks it answered without its run being finished
+    def _finish_question(
+        self, question_id: str, activity: Optional[dict], claim_id: Optional[str], activity_id: str, choice: str, answerer: str
+    ) -> Optional[dict]:
+        answered = False
+        try:
+            question_result = self._get_question_result(question_id, activity)
+            if question_result is None:
+                return None
+
+            param, connector_result = question_result
+            result = ActionResult(param)
+            result.set_status(phantom.APP_SUCCESS)
+            result.add_data({"answer": choice, "answered_by": answerer})
+            connector_result.add_item(result)
+            connector_result.postprocess_action_results()
+            self.soar_rest_client.finish_related_connector_run(question_id, result=connector_result.get_dict())
+            answered = True
+        finally:
+            if claim_id:
+                # The index is best-effort, an expired claim is released by the next answer anyway
+                try:
+                    if answered:
+                        answer_activity(self.client_id, activity_id, choice, answerer)
+                    else:
+                        release_activity(self.client_id, activity_id, claim_id)
+                except Exception:
+                    pass
+
+        return param
+
+    # The other cards are in other conversations, so they are updated through the adapter rather than the turn context
+    async def _update_question_cards(self, turn_context: TurnContext, activities: dict[str, Optional[str]], card: Attachment):
+        updates = [
+            turn_context.adapter.update_activity(
+                turn_context, Activity(type="message", id=activity_id, conversation=ConversationAccount(id=conversation_id), attachments=[card])
+            )
+            for activity_id, conversation_id in activities.items()
+            if activity_id != turn_context.activity.reply_to_id and conversation_id
+        ]
+        await asyncio.gather(*updates, return_exceptions=True)
 
     async def on_message_activity(self, turn_context: TurnContext):
         if message_value := turn_context.activity.value:
@@ -152,39 +400,65 @@ class SOARBot(ActivityHandler):
                 answerer = turn_context.activity.from_property.name
                 original_activity_id = turn_context.activity.reply_to_id
 
-                app_run = self.soar_rest_client.get_related_connector_run(original_activity_id)
-                if not (isinstance(intermediate_results := app_run.get("result_data"), list) and intermediate_results):
-                    raise ValueError(f"Could not find connector run for message {original_activity_id}")
-
-                if not (isinstance(first_result := intermediate_results[0], dict)):
-                    raise ValueError(f"Could not get intermediate connector run results for message {original_activity_id}")
+                # The index and SOAR REST calls block, so they run in worker threads to keep the shared loop serving other requests.
+                # The index is best-effort, when it cannot be read or written the question is looked up through SOAR instead.
+                claim_id = uuid.uuid4().hex
+                try:
+                    activity, claimed = await asyncio.to_thread(claim_activity, self.client_id, original_activity_id, claim_id)
+                except Exception:
+                    activity, claimed = None, False
+
+                if activity is not None and "answer" in activity:
+                    param = activity.get("parameter", {})
+                    answer_card = create_completed_question_card(
+                        param[MSTEAMS_JSON_MSG],
+                        get_list_from_string(param.get(MSTEAMS_JSON_CHOICES, "")),
+                        activity["answer"],
+                        activity["answered_by"],
+                    )
+                    await turn_context.update_activity(Activity(type="message", id=original_activity_id, attachments=[answer_card]))
+                    return
+
+                if activity is not None and not claimed:
+                    await turn_context.send_activity(MSTEAMS_ASK_QUESTION_PENDING_MSG)
+                    return
+
+                # Cards sent before the question ID was added to them were suspended on their activity ID
+                question_id = message_value.get("question_id") or (activity or {}).get("question_id") or original_activity_id
+
+                try:
+                    param = await asyncio.to_thread(
+                        self._finish_question, question_id, activity, claim_id if claimed else None, original_activity_id, choice, answerer
+                    )
+                except Exception:
+                    await turn_context.send_activity(MSTEAMS_ASK_QUESTION_ERROR_MSG)
+                    return
+
+                if param is None:
+                    await turn_context.send_activity(MSTEAMS_ASK_QUESTION_ANSWERED_MSG)
+                    return
+
+                answer_card = create_completed_question_card(
+                    param[MSTEAMS_JSON_MSG], get_list_from_string(param.get(MSTEAMS_JSON_CHOICES, "")), choice, answerer
+                )
+                replacement_activity = Activity(type="message", id=original_activity_id, attachments=[answer_card])
+                await turn_context.update_activity(replacement_activity)
+                if activity is not None:
+                    await self._update_question_cards(turn_context, activity.get("activities") or {}, answer_card)
 
-                param = first_result.get("parameter", {})
-                connector_result = ConnectorResult.from_dict(first_result)
 
-                message = param[MSTEAMS_JSON_MSG]
-                choices = param.get(MSTEAMS_JSON_CHOICES, "")
+ICONS_PATH = Path(__file__).parent / "img" / "bot_icons"
+ICON_NAMES = ["color.png", "outline.png"]
 
-                choices_split = get_list_from_string(choices)
-
-                result = ActionResult(param)
-                result.set_status(phantom.APP_SUCCESS)
-                result.add_data({"answer": choice, "answered_by": answerer})
-                connector_result.add_item(result)
-                connector_result.postprocess_action_results()
-                self.soar_rest_client.finish_related_connector_run(original_activity_id, result=connector_result.get_dict())
-
-                answer_card = create_completed_question_card(message, choices_split, choice, answerer)
-                replacement_activity = Activity(type="message", id=original_activity_id, attachments=[answer_card])
-                await turn_context.update_activity(replacement_activity)
+# Built app packages by client ID, along with the icon modification times they were built from and their ETag
+_app_package_cache: dict[str, tuple[list[int], bytes, str]] = {}
 
 
 def create_app_package(asset: dict) -> bytes:
     zip_bytes = BytesIO()
     with ZipFile(zip_bytes, mode="w") as zip_file:
-        icons_path = Path(__file__).parent / "img" / "bot_icons"
-        for icon_name in ["color.png", "outline.png"]:
-            icon_path = icons_path / icon_name
+        for icon_name in ICON_NAMES:
+            icon_path = ICONS_PATH / icon_name
             zip_file.write(icon_path, arcname=icon_name)
 
         manifest = {
@@ -220,6 +494,30 @@ def create_app_package(asset: dict) -> bytes:
     return zip_bytes.read()
 
 
+# The package only depends on the client ID and the icons, so it is rebuilt only when one of them changes
+def get_app_package(asset: dict) -> tuple[bytes, str]:
+    client_id = asset.get("client_id")
+    icon_mtimes = [(ICONS_PATH / icon_name).stat().st_mtime_ns for icon_name in ICON_NAMES]
+
+    cached_package = _app_package_cache.get(client_id)
+    if cached_package and cached_package[0] == icon_mtimes:
+        return cached_package[1], cached_package[2]
+
+    package = create_app_package(asset)
+    etag = f'"{hashlib.sha256(json.dumps([client_id, icon_mtimes]).encode()).hexdigest()}"'
+    _app_package_cache[client_id] = (icon_mtimes, package, etag)
+    return package, etag
+
+
+def _etag_matches(headers: dict[str, str], etag: str) -> bool:
+    if_none_match = next((value for name, value in headers.items() if name.lower() == "if-none-match"), None)
+    if not if_none_match:
+        return False
+
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
 # Type alias that accepts both the string values provided by SOAR 6.x and the list values provided by SOAR 7.x
 QueryParameters = dict[str, Union[str, list[str]]]
 
@@ -228,17 +526,25 @@ def handle_webhook(
     method: str, headers: dict[str, str], path_parts: list[str], query: QueryParameters, body: str, asset: dict, soar_rest_client
 ):
     if path_parts == ["app_package"]:
+        package, etag = get_app_package(asset)
+        if _etag_matches(headers, etag):
+            return {"status_code": 304, "headers": [("ETag", etag)], "content": ""}
+
         return {
             "status_code": 200,
             "headers": [
                 ("Content-Type", "application/zip"),
                 ("Content-Disposition", 'attachment; filename="appPackage.zip"'),
+                ("ETag", etag),
             ],
-            "content": create_app_package(asset),
+            "content": package,
         }
 
-    bot = SOARBot(soar_rest_client)
-    adapter = SOARWebhookAdapter(BotFrameworkAdapterSettings(asset.get("client_id"), app_password=asset.get("client_secret")))
+    bot = SOARBot(soar_rest_client, asset.get("client_id"))
+    adapter = get_webhook_adapter(asset.get("client_id"), asset.get("client_secret"))
     response_awaitable = adapter.process(method, path_parts, headers, body, bot)
 
-    return asyncio.run(response_awaitable)
+    try:
+        return run_coroutine(response_awaitable, MSTEAMS_WEBHOOK_TIMEOUT)
+    except concurrent.futures.TimeoutError:
+        return {"status_code": 504, "headers": {}, "content": ""}
@@ -0,0 +1,145 @@
+# File: test_app_files.py
+#
+# Copyright (c) 2019-2026 Splunk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+import json
+import multiprocessing
+import os
+
+import pytest
+
+
+pytest.importorskip("phantom")
+pytest.importorskip("encryption_helper")
+
+import microsoftteams_connector
+
+
+ASSET_ID = "1"
+FILE_NAME = "state.json"
+WRITERS = 8
+KEYS_PER_WRITER = 25
+RUNS_PER_WRITER = 10
+
+CONFIG = {"tenant_id": "tenant", "client_id": "client", "client_secret": "secret", "scope": "offline_access"}  # pragma: allowlist secret
+INITIAL_STATE = {"token": {"access_token": "cipher:access", "refresh_token": "cipher:refresh"}, "is_encrypted": True}
+
+
+class FakeEncryptionHelper:
+    def encrypt(self, plain_var, asset_id):
+        return f"cipher:{plain_var}"
+
+    def decrypt(self, encrypted_var, asset_id):
+        return encrypted_var.split(":", 1)[1]
+
+
+@pytest.fixture
+def app_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(microsoftteams_connector, "_get_app_file_path", lambda asset_id, file_name: str(tmp_path / f"{asset_id}_{file_name}"))
+    return tmp_path
+
+
+def _write_keys(writer):
+    # Each write reloads the file under the lock, like _save_state does, and adds one key
+    for index in range(KEYS_PER_WRITER):
+        with microsoftteams_connector._lock_app_file(ASSET_ID, FILE_NAME):
+            state = microsoftteams_connector._load_app_file(ASSET_ID, FILE_NAME)
+            state[f"{writer}_{index}"] = index
+            microsoftteams_connector._save_app_file(state, ASSET_ID, FILE_NAME)
+
+
+def _get_connector() -> microsoftteams_connector.MicrosoftTeamConnector:
+    # The platform keeps the state in the same file that _save_app_state writes
+    connector = microsoftteams_connector.MicrosoftTeamConnector()
+    connector.get_asset_id = lambda: ASSET_ID
+    connector.get_config = lambda: CONFIG
+    connector.load_state = lambda: microsoftteams_connector._load_app_file(ASSET_ID, FILE_NAME)
+    connector.save_state = lambda state: microsoftteams_connector._save_app_file(state, ASSET_ID, FILE_NAME)
+    return connector
+
+
+def _run_actions(writer):
+    # Writer 0 also refreshes the access token on every run, which the other writers must not overwrite
+    for run in range(RUNS_PER_WRITER):
+        connector = _get_connector()
+        assert connector.initialize() == microsoftteams_connector.phantom.APP_SUCCESS
+        connector._state[f"writer_{writer}"] = run
+        if writer == 0:
+            connector._access_token = f"access_{run}"
+        assert connector.finalize() == microsoftteams_connector.phantom.APP_SUCCESS
+
+
+def _read_file(path, stop, errors):
+    while not stop.is_set():
+        try:
+            with open(path) as file_obj:
+                json.load(file_obj)
+        except FileNotFoundError:
+            continue
+        except ValueError:
+            errors.value += 1
+
+
+def test_concurrent_writers_keep_every_key(app_dir):
+    context = multiprocessing.get_context("fork")
+    stop = context.Event()
+    errors = context.Value("i", 0)
+    path = os.path.join(app_dir, f"{ASSET_ID}_{FILE_NAME}")
+
+    reader = context.Process(target=_read_file, args=(path, stop, errors))
+    reader.start()
+    writers = [context.Process(target=_write_keys, args=(writer,)) for writer in range(WRITERS)]
+    for process in writers:
+        process.start()
+    for process in writers:
+        process.join()
+    stop.set()
+    reader.join()
+
+    assert all(process.exitcode == 0 for process in writers)
+    assert errors.value == 0
+    with open(path) as file_obj:
+        state = json.load(file_obj)
+    assert state == {f"{writer}_{index}": index for writer in range(WRITERS) for index in range(KEYS_PER_WRITER)}
+    assert [name for name in os.listdir(app_dir) if name.startswith(".")] == []
+
+
+def test_concurrent_actions_keep_every_key_and_token(app_dir, monkeypatch):
+    monkeypatch.setattr(microsoftteams_connector, "encryption_helper", FakeEncryptionHelper())
+    microsoftteams_connector._save_app_file(INITIAL_STATE, ASSET_ID, FILE_NAME)
+    context = multiprocessing.get_context("fork")
+
+    writers = [context.Process(target=_run_actions, args=(writer,)) for writer in range(WRITERS)]
+    for process in writers:
+        process.start()
+    for process in writers:
+        process.join()
+
+    assert all(process.exitcode == 0 for process in writers)
+    state = microsoftteams_connector._load_app_file(ASSET_ID, FILE_NAME)
+    assert {writer: state.get(f"writer_{writer}") for writer in range(WRITERS)} == dict.fromkeys(range(WRITERS), RUNS_PER_WRITER - 1)
+    assert state["token"] == {"access_token": f"cipher:access_{RUNS_PER_WRITER - 1}", "refresh_token": "cipher:refresh"}
+
+
+def test_unchanged_action_does_not_write_state(app_dir, monkeypatch):
+    monkeypatch.setattr(microsoftteams_connector, "encryption_helper", FakeEncryptionHelper())
+    microsoftteams_connector._save_app_file(INITIAL_STATE, ASSET_ID, FILE_NAME)
+    path = os.path.join(app_dir, f"{ASSET_ID}_{FILE_NAME}")
+    stat = os.stat(path)
+
+    connector = _get_connector()
+    connector.save_state = lambda state: pytest.fail("The unchanged state was saved")
+    assert connector.initialize() == microsoftteams_connector.phantom.APP_SUCCESS
+    assert connector.finalize() == microsoftteams_connector.phantom.APP_SUCCESS
+
+    assert (os.stat(path).st_ino, os.stat(path).st_mtime_ns) == (stat.st_ino, stat.st_mtime_ns)
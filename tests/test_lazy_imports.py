@@ -0,0 +1,60 @@
+# File: test_lazy_imports.py
+#
+# Copyright (c) 2019-2026 Splunk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+pytest.importorskip("phantom")
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only the actions and REST handlers that need these packages import them
+LAZY_MODULES = ["botbuilder", "bs4", "django"]
+
+# Cumulative import time of the connector module, in microseconds. Importing the Bot Framework and aiohttp alone exceeds it.
+CONNECTOR_IMPORT_BUDGET_US = 500_000
+IMPORT_TIME_RUNS = 3
+
+
+def _get_cumulative_import_time(module_name: str) -> int:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module_name}"], cwd=APP_DIR, capture_output=True, text=True, check=True
+    )
+    # Each line is "import time: <self us> | <cumulative us> | <indented module name>"
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and line.split("|")[-1].strip() == module_name:
+            return int(line.split("|")[1])
+
+    raise AssertionError(f"{module_name} not found in the -X importtime output")
+
+
+def test_connector_import_skips_lazy_modules():
+    code = "import json, sys; import microsoftteams_connector; print(json.dumps(sorted({name.split('.')[0] for name in sys.modules})))"
+    result = subprocess.run([sys.executable, "-c", code], cwd=APP_DIR, capture_output=True, text=True, check=True)
+    imported_modules = json.loads(result.stdout.splitlines()[-1])
+
+    assert "microsoftteams_connector" in imported_modules
+    assert [name for name in LAZY_MODULES if name in imported_modules] == []
+
+
+def test_connector_import_time_within_budget():
+    # The fastest of a few runs, so a busy machine does not fail the test
+    import_time = min(_get_cumulative_import_time("microsoftteams_connector") for _ in range(IMPORT_TIME_RUNS))
+
+    assert import_time <= CONNECTOR_IMPORT_BUDGET_US, f"Importing the connector took {import_time} us, over {CONNECTOR_IMPORT_BUDGET_US} us"
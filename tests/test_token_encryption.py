@@ -0,0 +1,149 @@
+# File: test_token_encryption.py
+#
+# Copyright (c) 2019-2026 Splunk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+import copy
+import itertools
+import statistics
+import time
+
+import pytest
+
+
+pytest.importorskip("phantom")
+pytest.importorskip("encryption_helper")
+
+import microsoftteams_connector
+
+
+BENCHMARK_RUNS = 20
+
+# Simulated time to encrypt a token, in seconds
+SIMULATED_ENCRYPTION_TIME = 0.002
+
+CONFIG = {"tenant_id": "tenant", "client_id": "client", "client_secret": "secret", "scope": "offline_access"}  # pragma: allowlist secret
+
+
+class FakeEncryptionHelper:
+    def __init__(self):
+        self.encrypt_calls = []
+        self._counter = itertools.count()
+
+    def encrypt(self, plain_var, asset_id):
+        self.encrypt_calls.append(plain_var)
+        return f"cipher-{next(self._counter)}:{plain_var}"
+
+    def decrypt(self, encrypted_var, asset_id):
+        return encrypted_var.split(":", 1)[1]
+
+
+class SlowEncryptionHelper(FakeEncryptionHelper):
+    def encrypt(self, plain_var, asset_id):
+        time.sleep(SIMULATED_ENCRYPTION_TIME)
+        return super().encrypt(plain_var, asset_id)
+
+
+class StateStore:
+    def __init__(self, state):
+        self.state = state
+        self.saves = 0
+
+    def load_state(self):
+        return copy.deepcopy(self.state)
+
+    def save_state(self, state):
+        self.saves += 1
+        self.state = copy.deepcopy(state)
+
+
+@pytest.fixture
+def encryption_helper(monkeypatch):
+    helper = FakeEncryptionHelper()
+    monkeypatch.setattr(microsoftteams_connector, "encryption_helper", helper)
+    return helper
+
+
+@pytest.fixture
+def connector():
+    connector = microsoftteams_connector.MicrosoftTeamConnector()
+    connector.asset_id = "1"
+    return connector
+
+
+def test_unchanged_token_reuses_ciphertext(connector, encryption_helper):
+    access_token = connector.decrypt_state("stored:token", "access")
+
+    assert connector.encrypt_state(access_token, "access") == "stored:token"
+    assert encryption_helper.encrypt_calls == []
+
+
+def test_changed_token_is_encrypted_again(connector, encryption_helper):
+    connector.decrypt_state("stored:token", "access")
+
+    encrypted_token = connector.encrypt_state("new_token", "access")
+
+    assert encrypted_token != "stored:token"
+    assert encryption_helper.decrypt(encrypted_token, "1") == "new_token"
+    assert connector.encrypt_state("new_token", "access") == encrypted_token
+    assert encryption_helper.encrypt_calls == ["new_token"]
+
+
+def test_ciphertexts_are_kept_per_token(connector, encryption_helper):
+    connector.decrypt_state("stored:token", "access")
+
+    encrypted_token = connector.encrypt_state("token", "refresh")
+
+    assert encrypted_token != "stored:token"
+    assert encryption_helper.encrypt_calls == ["token"]
+
+
+@pytest.fixture
+def state_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(microsoftteams_connector, "_get_app_file_path", lambda asset_id, file_name: str(tmp_path / f"{asset_id}_{file_name}"))
+    return StateStore({"token": {"access_token": "stored:access", "refresh_token": "stored:refresh"}, "is_encrypted": True})
+
+
+def _run_action(state_store, access_token=None) -> float:
+    connector = microsoftteams_connector.MicrosoftTeamConnector()
+    connector.get_asset_id = lambda: "1"
+    connector.get_config = lambda: CONFIG
+    connector.load_state = state_store.load_state
+    connector.save_state = state_store.save_state
+
+    start = time.perf_counter()
+    assert connector.initialize() == microsoftteams_connector.phantom.APP_SUCCESS
+    if access_token:
+        connector._access_token = access_token
+    assert connector.finalize() == microsoftteams_connector.phantom.APP_SUCCESS
+    return time.perf_counter() - start
+
+
+def test_per_action_overhead(state_store, monkeypatch):
+    encryption_helper = SlowEncryptionHelper()
+    monkeypatch.setattr(microsoftteams_connector, "encryption_helper", encryption_helper)
+
+    unchanged_overhead = statistics.median(_run_action(state_store) for _ in range(BENCHMARK_RUNS))
+
+    assert encryption_helper.encrypt_calls == []
+    assert state_store.saves == 0
+
+    changed_overhead = statistics.median(_run_action(state_store, f"access_{run}") for run in range(BENCHMARK_RUNS))
+
+    assert encryption_helper.encrypt_calls == [f"access_{run}" for run in range(BENCHMARK_RUNS)]
+    assert state_store.saves == BENCHMARK_RUNS
+    assert state_store.state["token"]["refresh_token"] == "stored:refresh"
+
+    print(
+        f"Median initialize and finalize time: {unchanged_overhead * 1000:.2f} ms unchanged, {changed_overhead * 1000:.2f} ms with a new token"
+    )
+    assert changed_overhead - unchanged_overhead >= SIMULATED_ENCRYPTION_TIME
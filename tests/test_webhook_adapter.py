@@ -0,0 +1,45 @@
+# File: test_webhook_adapter.py
+#
+# Copyright (c) 2019-2026 Splunk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+import pytest
+
+
+pytest.importorskip("phantom")
+pytest.importorskip("botbuilder.core")
+
+import microsoftteams_webhook
+
+
+@pytest.fixture(autouse=True)
+def adapter_cache(monkeypatch):
+    monkeypatch.setattr(microsoftteams_webhook, "_adapter_cache", {})
+
+
+def test_same_credentials_reuse_adapter():
+    adapter = microsoftteams_webhook.get_webhook_adapter("client", "secret")
+
+    assert microsoftteams_webhook.get_webhook_adapter("client", "secret") is adapter
+    assert len(microsoftteams_webhook._adapter_cache) == 1
+
+
+def test_rotated_secret_replaces_adapter():
+    adapter = microsoftteams_webhook.get_webhook_adapter("client", "secret")
+    other_adapter = microsoftteams_webhook.get_webhook_adapter("other_client", "secret")
+
+    rotated_adapter = microsoftteams_webhook.get_webhook_adapter("client", "rotated_secret")
+
+    assert rotated_adapter is not adapter
+    assert microsoftteams_webhook.get_webhook_adapter("client", "rotated_secret") is rotated_adapter
+    assert microsoftteams_webhook.get_webhook_adapter("other_client", "secret") is other_adapter
+    assert len(microsoftteams_webhook._adapter_cache) == 2
@@ -0,0 +1,133 @@
+# File: test_webhook_benchmark.py
+#
+# Copyright (c) 2019-2026 Splunk Inc.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software distributed under
+# the License is distributed on an "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND,
+# either express or implied. See the License for the specific language governing permissions
+# and limitations under the License.
+import json
+import statistics
+import time
+
+import pytest
+
+
+pytest.importorskip("phantom")
+pytest.importorskip("botbuilder.core")
+microsoft_app_credentials = pytest.importorskip("botframework.connector.auth.microsoft_app_credentials")
+
+import requests
+from botframework.connector.auth import ClaimsIdentity, JwtTokenValidation
+
+import microsoftteams_connector
+import microsoftteams_webhook
+
+
+BENCHMARK_REQUESTS = 10
+
+# Simulated latency of an Azure AD round trip (authority discovery or a token request) and of a Bot Connector call, in seconds
+SIMULATED_AAD_LATENCY = 0.05
+SIMULATED_CONNECTOR_LATENCY = 0.01
+
+ASSET = {"client_id": "client", "client_secret": "secret"}
+
+
+class FakeConfidentialClientApplication:
+    # Stands in for the msal app each MicrosoftAppCredentials builds, which discovers the authority when created
+    def __init__(self, client_id, client_credential, authority):
+        time.sleep(SIMULATED_AAD_LATENCY)
+        self._token = None
+
+    def acquire_token_silent(self, scopes, account):
+        return self._token
+
+    def acquire_token_for_client(self, scopes):
+        time.sleep(SIMULATED_AAD_LATENCY)
+        self._token = {"access_token": "token", "expires_in": 3600}
+        return self._token
+
+
+class FakeSOARRestClient:
+    def get_related_connector_run(self, key):
+        return {"result_data": [{"parameter": {"message": "Approve?", "choices": "yes,no"}}]}
+
+    def finish_related_connector_run(self, key, result):
+        pass
+
+
+def _send_to_connector(adapter, request, **kwargs):
+    time.sleep(SIMULATED_CONNECTOR_LATENCY)
+    response = requests.Response()
+    response.status_code = 200
+    response.headers["Content-Type"] = "application/json"
+    response._content = b'{"id": "activity"}'
+    response.request = request
+    response.url = request.url
+    return response
+
+
+async def _authenticate_request(activity, auth_header, credentials, channel_service_or_provider=None, auth_config=None):
+    return ClaimsIdentity({"aud": ASSET["client_id"], "appid": ASSET["client_id"], "ver": "1.0"}, True)
+
+
+def _get_answer_body(index: int) -> str:
+    return json.dumps(
+        {
+            "type": "message",
+            "id": f"answer_{index}",
+            "channelId": "msteams",
+            "serviceUrl": "https://smba.trafficmanager.net/amer/",
+            "from": {"id": "user", "name": "User"},
+            "recipient": {"id": ASSET["client_id"]},
+            "conversation": {"id": "conversation"},
+            "replyToId": f"card_{index}",
+            "value": {"choice": "yes", "question_id": f"question_{index}"},
+        }
+    )
+
+
+def _get_answer_latencies() -> list[float]:
+    latencies = []
+    for index in range(BENCHMARK_REQUESTS):
+        start = time.perf_counter()
+        response = microsoftteams_webhook.handle_webhook(
+            "POST", {"Authorization": "Bearer token"}, [], {}, _get_answer_body(index), ASSET, FakeSOARRestClient()
+        )
+        latencies.append(time.perf_counter() - start)
+        assert response["status_code"] in (200, 201)
+
+    return latencies
+
+
+@pytest.fixture(autouse=True)
+def external_services(tmp_path, monkeypatch):
+    monkeypatch.setattr(microsoftteams_connector, "_get_app_file_path", lambda asset_id, file_name: str(tmp_path / f"{asset_id}_{file_name}"))
+    monkeypatch.setattr(microsoftteams_webhook, "_adapter_cache", {})
+    monkeypatch.setattr(microsoft_app_credentials, "ConfidentialClientApplication", FakeConfidentialClientApplication)
+    monkeypatch.setattr(requests.adapters.HTTPAdapter, "send", _send_to_connector)
+    monkeypatch.setattr(JwtTokenValidation, "authenticate_request", _authenticate_request)
+
+
+def test_cached_adapter_answer_latency(monkeypatch):
+    cached_latency = statistics.median(_get_answer_latencies())
+
+    # Before the cache every request built its own adapter, and with it new app credentials and connector clients
+    monkeypatch.setattr(
+        microsoftteams_webhook,
+        "get_webhook_adapter",
+        lambda client_id, client_secret: microsoftteams_webhook.SOARWebhookAdapter(
+            microsoftteams_webhook.BotFrameworkAdapterSettings(client_id, app_password=client_secret)
+        ),
+    )
+    uncached_latency = statistics.median(_get_answer_latencies())
+
+    print(f"Median answer latency: {uncached_latency * 1000:.1f} ms per new adapter, {cached_latency * 1000:.1f} ms with the cached adapter")
+    # A new adapter pays for the authority discovery and the token request on every answer
+    assert uncached_latency - cached_latency >= SIMULATED_AAD_LATENCY